@@ -0,0 +1,130 @@
+import argparse
+import asyncio
+import glob
+import json
+import os
+import subprocess
+import sys
+import time
+
+import aiohttp
+
+SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server.py')
+RAW_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'raw-data-geoshield')
+
+
+def load_texts(data_dir, count):
+    """
+    Load message texts from the raw-data-geoshield snapshot.
+
+    Args:
+        data_dir (str): The directory of the snapshot.
+        count (int): The number of texts to load.
+
+    Returns:
+        list: The texts, repeated if the snapshot has fewer.
+    """
+    texts = []
+    for file_path in sorted(glob.glob(os.path.join(data_dir, '*.json'))):
+        with open(file_path) as file:
+            try:
+                data = json.load(file)
+            except ValueError:
+                continue
+        texts.extend(message["message"] for message in data if isinstance(message, dict) and message.get("message"))
+        if len(texts) >= count:
+            break
+    return (texts * (count // max(len(texts), 1) + 1))[:count]
+
+
+async def run_load(url, texts, concurrency):
+    """
+    Send one /predict request per text, with `concurrency` requests in flight, the way many concurrent
+    data_classification invocations do.
+
+    Args:
+        url (str): The base URL of the server.
+        texts (list): The texts to classify.
+        concurrency (int): The number of requests in flight.
+
+    Returns:
+        dict: The throughput, the latency percentiles and the metrics of the server.
+    """
+    latencies = []
+    pending = iter(texts)
+
+    async def worker(session):
+        for text in pending:
+            started = time.perf_counter()
+            async with session.post(url + '/predict', json={"text": text}) as response:
+                output = await response.json()
+                assert "Predicted" in output and "Score" in output, output
+            latencies.append(time.perf_counter() - started)
+
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=concurrency)) as session:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(session) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        async with session.get(url + '/metrics') as response:
+            metrics = await response.json()
+
+    latencies.sort()
+    percentile = lambda share: round(latencies[min(int(share * len(latencies)), len(latencies) - 1)] * 1000, 1)
+    return {"requests_per_second": round(len(texts) / elapsed, 1), "p50_ms": percentile(0.5), "p95_ms": percentile(0.95),
+            "p99_ms": percentile(0.99), "server": metrics}
+
+
+def start_server(port, max_batch_size, max_wait_ms, simulated_forward_ms, model):
+    """
+    Start the predict server in a subprocess and wait for it to answer.
+
+    Returns:
+        subprocess.Popen: The server process.
+    """
+    process = subprocess.Popen([sys.executable, SERVER, '--port', str(port), '--max-batch-size', str(max_batch_size),
+                                '--max-wait-ms', str(max_wait_ms), '--simulated-forward-ms', str(simulated_forward_ms)]
+                               + (['--model', model] if model else []),
+                               cwd=os.path.dirname(SERVER), stdout=subprocess.DEVNULL)
+
+    async def wait_ready():
+        async with aiohttp.ClientSession() as session:
+            for _ in range(600):
+                try:
+                    async with session.get(f'http://localhost:{port}/metrics'):
+                        return
+                except aiohttp.ClientError:
+                    await asyncio.sleep(0.1)
+        raise RuntimeError("The predict server did not start")
+
+    asyncio.run(wait_ready())
+    return process
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the micro-batching predict server")
+    parser.add_argument('--url', help="base URL of a running server; without it, servers are started locally "
+                                      "with a batch size of 1 and of --max-batch-size, for comparison")
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--data-dir', default=RAW_DATA_DIR)
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--model', help="model of the started servers, the one of config.ini if omitted")
+    parser.add_argument('--max-batch-size', type=int, default=32)
+    parser.add_argument('--max-wait-ms', type=float, default=10)
+    parser.add_argument('--simulated-forward-ms', type=float, default=0)
+    args = parser.parse_args()
+
+    texts = load_texts(args.data_dir, args.requests)
+    if args.url:
+        print(json.dumps(asyncio.run(run_load(args.url, texts, args.concurrency)), indent=1))
+    else:
+        for max_batch_size in (1, args.max_batch_size):
+            server = start_server(args.port, max_batch_size, args.max_wait_ms, args.simulated_forward_ms, args.model)
+            try:
+                result = asyncio.run(run_load(f'http://localhost:{args.port}', texts, args.concurrency))
+            finally:
+                server.terminate()
+                server.wait()
+            metrics = result.pop("server")
+            print(f"max_batch_size {max_batch_size:>3}: {json.dumps(result)} average batch {metrics['average_batch_size']}, "
+                  f"max queue depth {metrics['max_queue_depth']}, average forward {metrics['average_forward_ms']} ms")
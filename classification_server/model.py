@@ -0,0 +1,159 @@
+import argparse
+import glob
+import hashlib
+import json
+import os
+import re
+import zlib
+
+import numpy as np
+
+# Local snapshot of the classified-data-geoshield bucket, whose messages carry the category they were classified in
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'classified-data-geoshield')
+DEFAULT_CENTROID_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'centroid_model.npz')
+
+# Size of the hashed bag-of-words vectors of the centroid model
+FEATURES = 2 ** 16
+
+
+def featurize(texts):
+    """
+    Turn texts into L2-normalized hashed bag-of-words vectors.
+
+    Args:
+        texts (list): The texts.
+
+    Returns:
+        numpy.ndarray: One row per text.
+    """
+    matrix = np.zeros((len(texts), FEATURES), dtype=np.float32)
+    for row, text in enumerate(texts):
+        for word in re.findall(r'\w+', text.lower()):
+            matrix[row, zlib.crc32(word.encode('utf-8')) % FEATURES] += 1
+    return matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-9)
+
+
+class CentroidModel:
+    """
+    Baseline classifier runnable on any CPU: the cosine similarity of a text to the mean vector of each
+    category, turned into a score by a softmax. A batch is one matrix product.
+    """
+
+    def __init__(self, path=DEFAULT_CENTROID_PATH, temperature=20.0):
+        """
+        Args:
+            path (str): The .npz file written by train_centroids.
+            temperature (float): The sharpness of the softmax over the similarities.
+        """
+        with np.load(path) as model:
+            self.labels = [str(label) for label in model["labels"]]
+            self.centroids = model["centroids"]
+        self.temperature = temperature
+        # A rebuilt model file gets a new version, which invalidates the cached results of the old one
+        with open(path, 'rb') as file:
+            self.version = f"centroid-{hashlib.sha256(file.read()).hexdigest()[:12]}-t{temperature:g}"
+
+    def predict(self, texts):
+        """
+        Classify a batch of texts in one forward pass.
+
+        Args:
+            texts (list): The texts.
+
+        Returns:
+            list: A {"Predicted", "Score"} dict per text.
+        """
+        logits = featurize(texts) @ self.centroids.T * self.temperature
+        probabilities = np.exp(logits - logits.max(axis=1, keepdims=True))
+        probabilities /= probabilities.sum(axis=1, keepdims=True)
+        best = probabilities.argmax(axis=1)
+        return [{"Predicted": self.labels[index], "Score": round(float(probabilities[row, index]), 4)}
+                for row, index in enumerate(best)]
+
+
+class TransformersModel:
+    """
+    A fine-tuned Hugging Face text classification model, run on CPU. A batch is one call of the pipeline.
+    """
+
+    def __init__(self, name_or_path):
+        """
+        Args:
+            name_or_path (str): The model name or directory, whose labels are the GEOSHIELD categories.
+        """
+        # Imported here, so that the centroid model runs without transformers and torch installed
+        from transformers import pipeline
+        self.pipeline = pipeline("text-classification", model=name_or_path, device=-1)
+        # The commit of a Hub model; a local directory is versioned by its path unless config.ini sets a version
+        commit = getattr(self.pipeline.model.config, "_commit_hash", None)
+        self.version = f"transformers-{name_or_path}" + (f"@{commit[:12]}" if commit else "")
+
+    def predict(self, texts):
+        """
+        Classify a batch of texts in one forward pass.
+
+        Args:
+            texts (list): The texts.
+
+        Returns:
+            list: A {"Predicted", "Score"} dict per text.
+        """
+        outputs = self.pipeline(texts, batch_size=len(texts), truncation=True)
+        return [{"Predicted": output["label"], "Score": round(float(output["score"]), 4)} for output in outputs]
+
+
+def load_model(spec):
+    """
+    Load the model named by the configuration.
+
+    Args:
+        spec (str): 'centroid:<path of the .npz file>' or 'transformers:<model name or directory>'.
+
+    Returns:
+        CentroidModel or TransformersModel: The model.
+    """
+    kind, _, location = spec.partition(':')
+    if kind == 'centroid':
+        return CentroidModel(location or DEFAULT_CENTROID_PATH)
+    if kind == 'transformers':
+        return TransformersModel(location)
+    raise ValueError(f"Unknown model {spec!r}")
+
+
+def train_centroids(data_dir, output, chunk_size=512):
+    """
+    Build the centroid model from the classified messages of the snapshot.
+
+    Args:
+        data_dir (str): The directory of the classified-data-geoshield snapshot.
+        output (str): The path of the .npz file to write.
+        chunk_size (int): The number of texts featurized at once.
+    """
+    examples = []
+    for file_path in sorted(glob.glob(os.path.join(data_dir, '*'))):
+        with open(file_path) as file:
+            try:
+                data = json.load(file)
+            except ValueError:
+                continue
+        examples.extend((message["message"], message["classification"]) for message in data
+                        if isinstance(message, dict) and message.get("message") and message.get("classification"))
+
+    labels = sorted({label for _, label in examples})
+    sums = np.zeros((len(labels), FEATURES), dtype=np.float32)
+    for start in range(0, len(examples), chunk_size):
+        chunk = examples[start:start + chunk_size]
+        vectors = featurize([text for text, _ in chunk])
+        for vector, (_, label) in zip(vectors, chunk):
+            sums[labels.index(label)] += vector
+    centroids = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-9)
+    np.savez_compressed(output, labels=np.array(labels), centroids=centroids)
+    print(f"{len(examples)} messages, labels {labels}, written to {output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the centroid model of the reference predict server")
+    parser.add_argument('--data-dir', default=DATA_DIR)
+    parser.add_argument('--output', default=DEFAULT_CENTROID_PATH)
+    args = parser.parse_args()
+    train_centroids(args.data_dir, args.output)
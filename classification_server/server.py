@@ -0,0 +1,215 @@
+import argparse
+import asyncio
+import configparser
+import time
+from collections import Counter
+
+from aiohttp import web
+
+from model import load_model
+
+# Read configuration from config.ini
+config = configparser.ConfigParser()
+config.read("config.ini")
+
+
+class MicroBatcher:
+    """
+    Queue of texts to classify, grouped into micro-batches with one forward pass each.
+
+    A batch starts with the oldest queued text and closes when it holds max_batch_size texts or
+    max_wait_ms after it started, whichever comes first. Forward passes run one at a time in a worker
+    thread, so the event loop keeps accepting requests while the model runs.
+    """
+
+    def __init__(self, model, max_batch_size, max_wait_ms, simulated_forward_ms=0.0):
+        """
+        Args:
+            model: The model, with a predict(texts) method returning a {"Predicted", "Score"} dict per text.
+            max_batch_size (int): The maximum number of texts in a forward pass.
+            max_wait_ms (float): The maximum time a batch waits for more texts.
+            simulated_forward_ms (float): A fixed cost added to every forward pass, to load test the batching
+                with the centroid model as if it were a transformer on CPU.
+        """
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait_seconds = max_wait_ms / 1000
+        self.simulated_forward_seconds = simulated_forward_ms / 1000
+        self.queue = asyncio.Queue()
+        self.batch_sizes = Counter()
+        self.metrics = {"requests": 0, "texts": 0, "batches": 0, "max_queue_depth": 0,
+                        "queue_wait_seconds": 0.0, "forward_seconds": 0.0}
+
+    async def predict(self, texts):
+        """
+        Queue texts and wait for their outputs.
+
+        Args:
+            texts (list): The texts to classify.
+
+        Returns:
+            list: A {"Predicted", "Score"} dict per text.
+        """
+        loop = asyncio.get_running_loop()
+        futures = [loop.create_future() for _ in texts]
+        self.metrics["requests"] += 1
+        for text, future in zip(texts, futures):
+            self.queue.put_nowait((text, future, time.monotonic()))
+        self.metrics["max_queue_depth"] = max(self.metrics["max_queue_depth"], self.queue.qsize())
+        return await asyncio.gather(*futures)
+
+    def forward(self, texts):
+        """
+        Run one forward pass, in the worker thread.
+
+        Args:
+            texts (list): The texts of the batch.
+
+        Returns:
+            list: A {"Predicted", "Score"} dict per text.
+        """
+        if self.simulated_forward_seconds:
+            time.sleep(self.simulated_forward_seconds)
+        return self.model.predict(texts)
+
+    async def run(self):
+        """
+        Close batches from the queue and run their forward passes, until cancelled.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait_seconds
+            while len(batch) < self.max_batch_size:
+                if not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+                    continue
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            started = time.monotonic()
+            self.metrics["queue_wait_seconds"] += sum(started - queued_at for _, _, queued_at in batch)
+            try:
+                outputs = await loop.run_in_executor(None, self.forward, [text for text, _, _ in batch])
+            except Exception as e:
+                print("Forward pass failed:", e)
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.metrics["forward_seconds"] += time.monotonic() - started
+            self.metrics["batches"] += 1
+            self.metrics["texts"] += len(batch)
+            self.batch_sizes[len(batch)] += 1
+            for (_, future, _), output in zip(batch, outputs):
+                # The client of the request may have disconnected meanwhile
+                if not future.done():
+                    future.set_result(output)
+
+    def stats(self):
+        """
+        Return the queue and batch metrics.
+
+        Returns:
+            dict: The counters with the current queue depth, the average batch size, queue wait and
+            forward pass time, and the histogram of batch sizes.
+        """
+        batches = max(self.metrics["batches"], 1)
+        return {
+            "queue_depth": self.queue.qsize(),
+            "max_queue_depth": self.metrics["max_queue_depth"],
+            "requests": self.metrics["requests"],
+            "texts": self.metrics["texts"],
+            "batches": self.metrics["batches"],
+            "average_batch_size": round(self.metrics["texts"] / batches, 2),
+            "average_queue_wait_ms": round(self.metrics["queue_wait_seconds"] * 1000 / max(self.metrics["texts"], 1), 2),
+            "average_forward_ms": round(self.metrics["forward_seconds"] * 1000 / batches, 2),
+            "batch_sizes": dict(sorted(self.batch_sizes.items())),
+        }
+
+
+async def handle_predict(request):
+    """
+    Classify one text, {"text": ...}, into {"Predicted", "Score"}: the route data_classification calls.
+    """
+    try:
+        text = (await request.json())["text"]
+    except (ValueError, KeyError, TypeError):
+        return web.json_response({"error": "expected {\"text\": ...}"}, status=400)
+    output, = await request.app["batcher"].predict([text])
+    return web.json_response(output, headers={"X-Model-Version": request.app["version"]})
+
+
+async def handle_predict_batch(request):
+    """
+    Classify a list of texts, {"texts": [...]}, into the list of {"Predicted", "Score"} in the same order.
+    """
+    try:
+        texts = (await request.json())["texts"]
+    except (ValueError, KeyError, TypeError):
+        return web.json_response({"error": "expected {\"texts\": [...]}"}, status=400)
+    return web.json_response(await request.app["batcher"].predict(texts), headers={"X-Model-Version": request.app["version"]})
+
+
+async def handle_version(request):
+    """
+    Return the version of the model, {"version": ...}, which clients put in the keys of their cached results.
+    """
+    return web.json_response({"version": request.app["version"]})
+
+
+async def handle_metrics(request):
+    """
+    Return the queue and batch metrics.
+    """
+    return web.json_response(dict(request.app["batcher"].stats(), version=request.app["version"]))
+
+
+def create_app(model, max_batch_size, max_wait_ms, simulated_forward_ms=0.0, version=None):
+    """
+    Create the predict server.
+
+    Args:
+        model: The model, with a predict(texts) method and a version attribute.
+        max_batch_size (int): The maximum number of texts in a forward pass.
+        max_wait_ms (float): The maximum time a batch waits for more texts.
+        simulated_forward_ms (float): A fixed cost added to every forward pass, for load tests.
+        version (str): The reported model version, the one of the model if omitted.
+
+    Returns:
+        aiohttp.web.Application: The application, whose batcher runs while it is up.
+    """
+    app = web.Application()
+    app["version"] = version or model.version
+    app["batcher"] = MicroBatcher(model, max_batch_size, max_wait_ms, simulated_forward_ms)
+
+    async def run_batcher(app):
+        task = asyncio.create_task(app["batcher"].run())
+        yield
+        task.cancel()
+
+    app.cleanup_ctx.append(run_batcher)
+    app.add_routes([web.post('/predict', handle_predict),
+                    web.post('/predict_batch', handle_predict_batch),
+                    web.get('/version', handle_version),
+                    web.get('/metrics', handle_metrics)])
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reference micro-batching predict server of the classification model")
+    parser.add_argument('--model', default=config.get('SERVER', 'model', fallback='centroid:'))
+    parser.add_argument('--port', type=int, default=config.getint('SERVER', 'port', fallback=8080))
+    parser.add_argument('--max-batch-size', type=int, default=config.getint('SERVER', 'max_batch_size', fallback=32))
+    parser.add_argument('--max-wait-ms', type=float, default=config.getfloat('SERVER', 'max_wait_ms', fallback=10))
+    parser.add_argument('--simulated-forward-ms', type=float, default=config.getfloat('SERVER', 'simulated_forward_ms', fallback=0))
+    parser.add_argument('--version', default=config.get('SERVER', 'model_version', fallback='') or None)
+    args = parser.parse_args()
+
+    web.run_app(create_app(load_model(args.model), args.max_batch_size, args.max_wait_ms, args.simulated_forward_ms,
+                           args.version), port=args.port)
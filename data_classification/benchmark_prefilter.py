@@ -0,0 +1,107 @@
+import argparse
+import glob
+import json
+import os
+import re
+import time
+from collections import Counter
+
+from keyword_prefilter import KeywordPrefilter, load_keyword_banks
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+DEFAULT_BANKS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'keyword_banks.json')
+
+def load_files(root):
+    """
+    Pair every raw-data-geoshield file with its classified-data-geoshield file, which holds the messages the
+    model kept, and take the category of the pair from them.
+
+    Parameters:
+    - root (str): The root of the repository, with both local snapshots.
+
+    Returns:
+    - list: (category, raw message texts, set of kept message texts) tuples.
+    """
+    def read(file_path):
+        with open(file_path) as file:
+            try:
+                data = json.load(file)
+            except ValueError:
+                return []
+        return [message for message in data if isinstance(message, dict) and message.get("message")]
+
+    classified = {os.path.basename(file_path): file_path for file_path in glob.glob(os.path.join(root, 'classified-data-geoshield', '*'))}
+    files = []
+    for file_path in sorted(glob.glob(os.path.join(root, 'raw-data-geoshield', '*.json'))):
+        if os.path.basename(file_path) not in classified:
+            continue
+        kept = read(classified[os.path.basename(file_path)])
+        categories = Counter(message.get("classification") for message in kept if message.get("classification"))
+        if not categories:
+            continue
+        files.append((categories.most_common(1)[0][0], [message["message"] for message in read(file_path)],
+                      {message["message"] for message in kept}))
+    return files
+
+def classify_security_issue(text, keywords_file_path):
+    """
+    The keyword check of poc-code/ChannelMessages.py: the keyword file is read and the pattern compiled per message.
+
+    Parameters:
+    - text (str): The text to check.
+    - keywords_file_path (str): The JSON list of keywords.
+
+    Returns:
+    - list: The detected keywords.
+    """
+    with open(keywords_file_path, 'r') as keywords_file:
+        security_keywords = json.load(keywords_file)
+    pattern = re.compile('|'.join(map(re.escape, security_keywords)), re.IGNORECASE)
+    return pattern.findall(text)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the keyword prefilter: throughput and traffic saved")
+    parser.add_argument('--banks', default=DEFAULT_BANKS_PATH)
+    parser.add_argument('--root', default=ROOT)
+    args = parser.parse_args()
+
+    files = load_files(args.root)
+    texts = [text for _, raw, _ in files for text in raw]
+    print(f"{len(files)} raw files with a classified counterpart, {len(texts)} messages")
+
+    started = time.perf_counter()
+    prefilter = KeywordPrefilter(load_keyword_banks(args.banks))
+    print(f"automaton: {len(prefilter.transitions)} states, built in {(time.perf_counter() - started) * 1000:.1f} ms")
+
+    started = time.perf_counter()
+    for text in texts:
+        prefilter.scan(text)
+    elapsed = time.perf_counter() - started
+    print(f"automaton, all categories:        {len(texts) / elapsed:10.0f} messages/s")
+
+    sample = texts[:2000]
+    poc_keywords = os.path.join(args.root, 'poc-code', 'security_keywords.json')
+    started = time.perf_counter()
+    for text in sample:
+        classify_security_issue(text, poc_keywords)
+    elapsed = time.perf_counter() - started
+    print(f"poc regex, security only:          {len(sample) / elapsed:10.0f} messages/s")
+
+    sent = Counter()
+    dropped = Counter()
+    lost = Counter()
+    kept = Counter()
+    for category, raw, kept_texts in files:
+        for text in raw:
+            sent[category] += 1
+            if not prefilter.has_signal(text, category):
+                dropped[category] += 1
+                lost[category] += text in kept_texts
+        kept[category] += len(kept_texts & set(raw))
+
+    for category in sorted(sent):
+        print(f"{category:<18} {sent[category]:6} messages, {dropped[category] / sent[category]:6.1%} dropped before the model, "
+              f"{lost[category]} of {kept[category]} kept by the model among them ({lost[category] / max(kept[category], 1):.1%})")
+    total_sent, total_dropped = sum(sent.values()), sum(dropped.values())
+    print(f"{'total':<18} {total_sent:6} messages, {total_dropped / total_sent:6.1%} dropped before the model, "
+          f"{sum(lost.values())} of {sum(kept.values())} kept by the model among them ({sum(lost.values()) / max(sum(kept.values()), 1):.1%})")
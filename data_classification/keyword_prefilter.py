@@ -0,0 +1,125 @@
+import json
+import re
+from collections import Counter, deque
+
+# Automata built once per container, by keyword bank path
+_prefilters = {}
+
+def tokenize(text):
+    """
+    Split a text into lowercase word tokens, the unit the automaton matches on.
+
+    Parameters:
+    - text (str): The text to split.
+
+    Returns:
+    - list: The word tokens; "anti-semitism" and "Anti Semitism" both give ['anti', 'semitism'].
+    """
+    return re.findall(r'\w+', text.lower())
+
+class KeywordPrefilter:
+    """
+    Aho-Corasick automaton over word tokens, matching the keywords of every category in one pass over a text.
+
+    Keywords are matched as whole words or phrases, so "war" does not match "award" and
+    "hate speech" matches across any punctuation between the two words.
+    """
+
+    def __init__(self, keyword_banks):
+        """
+        Parameters:
+        - keyword_banks (dict): The list of keywords and phrases of each category.
+        """
+        self.categories = set(keyword_banks)
+        self.transitions = [{}]
+        self.fail = [0]
+        self.outputs = [set()]
+
+        for category, keywords in keyword_banks.items():
+            for keyword in keywords:
+                state = 0
+                for token in tokenize(keyword):
+                    if token not in self.transitions[state]:
+                        self.transitions.append({})
+                        self.fail.append(0)
+                        self.outputs.append(set())
+                        self.transitions[state][token] = len(self.transitions) - 1
+                    state = self.transitions[state][token]
+                if state:
+                    self.outputs[state].add(category)
+
+        # Breadth-first failure links: the longest proper suffix of a state's phrase that is also a prefix of a keyword
+        queue = deque(self.transitions[0].values())
+        while queue:
+            state = queue.popleft()
+            for token, next_state in self.transitions[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and token not in self.transitions[fallback]:
+                    fallback = self.fail[fallback]
+                candidate = self.transitions[fallback].get(token, 0)
+                # States of the first token fail to the root, not to themselves
+                self.fail[next_state] = candidate if candidate != next_state else 0
+                self.outputs[next_state] |= self.outputs[self.fail[next_state]]
+
+    def scan(self, text):
+        """
+        Count the keyword matches of every category in a text, at most one per category per token where
+        keywords end.
+
+        Parameters:
+        - text (str): The text to scan.
+
+        Returns:
+        - Counter: The number of keyword matches of each category with at least one.
+        """
+        hits = Counter()
+        state = 0
+        transitions, fail, outputs = self.transitions, self.fail, self.outputs
+        for token in tokenize(text):
+            while state and token not in transitions[state]:
+                state = fail[state]
+            state = transitions[state].get(token, 0)
+            if outputs[state]:
+                hits.update(outputs[state])
+        return hits
+
+    def has_signal(self, text, category):
+        """
+        Tell whether a text can belong to a category.
+
+        Parameters:
+        - text (str): The text to check.
+        - category (str): The category of the file.
+
+        Returns:
+        - bool: True if the text matches a keyword of the category, or the category has no keyword bank.
+        """
+        return category not in self.categories or self.scan(text)[category] > 0
+
+def load_keyword_banks(path):
+    """
+    Load the keyword banks.
+
+    Parameters:
+    - path (str): The JSON file with the list of keywords of each category.
+
+    Returns:
+    - dict: The list of keywords of each category.
+    """
+    with open(path) as file:
+        return json.load(file)
+
+def get_prefilter(path):
+    """
+    Return the prefilter of a keyword bank file, built on first use and kept across warm invocations.
+
+    Parameters:
+    - path (str): The JSON file with the list of keywords of each category.
+
+    Returns:
+    - KeywordPrefilter: The prefilter.
+    """
+    if path not in _prefilters:
+        _prefilters[path] = KeywordPrefilter(load_keyword_banks(path))
+    return _prefilters[path]
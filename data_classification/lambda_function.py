@@ -1,16 +1,246 @@
-import boto3
 import json
+import threading
+import time
 import requests
 import configparser
-
-# Initialize the Lambda client for invoking other Lambda functions
-lambda_client = boto3.client('lambda')
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from keyword_prefilter import get_prefilter
+from result_cache import TwoTierCache, content_key, make_store
+from pipeline import CLASSIFICATION_STAGE, EVENTS_STAGE, forward_to_first_stage, invoke_next_stage, read_stage_input
 
 # Read configuration from config.ini
 config = configparser.ConfigParser()
 config.read("config.ini")
 
-def classify_and_invoke(messages, file_name, category, bucket_name):
+BATCH_SIZE = config.getint('CLASSIFICATION', 'batch_size', fallback=32)
+PARALLELISM = config.getint('CLASSIFICATION', 'parallelism', fallback=8)
+TIMEOUT_SECONDS = config.getfloat('CLASSIFICATION', 'timeout_seconds', fallback=30)
+
+PREFILTER_MODE = config.get('PREFILTER', 'mode', fallback='passthrough')
+PREFILTER_KEYWORD_BANKS = config.get('PREFILTER', 'keyword_banks', fallback='keyword_banks.json')
+PREFILTER_RANK_MIN_SCORE = config.getfloat('PREFILTER', 'rank_min_score', fallback=0.8)
+
+CACHE_ENABLED = config.getboolean('CLASSIFICATION_CACHE', 'enabled', fallback=True)
+DEFAULT_MODEL_VERSION = config.get('CLASSIFICATION_CACHE', 'model_version', fallback='1')
+VERSION_TTL_SECONDS = config.getfloat('CLASSIFICATION_CACHE', 'version_ttl_seconds', fallback=300)
+
+# Model outputs by hash of the normalized text and model version, kept across warm invocations and in the store
+classification_cache = TwoTierCache(
+    store=make_store(
+        config.get('CLASSIFICATION_CACHE', 'store', fallback='none'),
+        bucket=config.get('CLASSIFICATION_CACHE', 'bucket', fallback='geoshield-cache'),
+        prefix=config.get('CLASSIFICATION_CACHE', 'prefix', fallback='classification-cache/'),
+        path=config.get('CLASSIFICATION_CACHE', 'path', fallback='/tmp/geoshield_cache/classification')
+    ),
+    max_entries=config.getint('CLASSIFICATION_CACHE', 'memory_entries', fallback=20000),
+    ttl_seconds=config.getfloat('CLASSIFICATION_CACHE', 'ttl_hours', fallback=720) * 3600
+)
+
+# Score a predicted category needs for the message to be kept
+MIN_SCORE = 0.4
+
+# Statuses of a model service without the batch route
+MISSING_ROUTE_STATUSES = {404, 405}
+
+# Kept across warm invocations: the keep-alive connection pool, and whether the batch route exists
+session = None
+session_lock = threading.Lock()
+batch_route_available = True
+# The version the model service last reported, and when it was last asked for it
+model_version = None
+model_version_checked_at = 0.0
+
+def get_session():
+    """
+    Return the HTTP session of the container, created on first use with a connection pool
+    of one connection per parallel request.
+
+    Returns:
+    - requests.Session: The session.
+    """
+    global session
+    with session_lock:
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=PARALLELISM)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+        return session
+
+def get_model_version():
+    """
+    Return the version of the model, asked from the version route of the model service at most once per TTL.
+    A service without the route is assumed to serve the model_version of config.ini.
+
+    Returns:
+    - str: The model version.
+    """
+    global model_version_checked_at
+    version_endpoint = config.get('EC2', 'VERSION_URL', fallback=None)
+    if version_endpoint and time.monotonic() - model_version_checked_at >= VERSION_TTL_SECONDS:
+        model_version_checked_at = time.monotonic()
+        try:
+            response = get_session().get(version_endpoint, timeout=TIMEOUT_SECONDS)
+            if response.status_code == 200:
+                note_model_version(response.json().get("version"))
+        except (requests.RequestException, ValueError) as e:
+            print("Model version request failed:", e)
+    return model_version or DEFAULT_MODEL_VERSION
+
+def note_model_version(version):
+    """
+    Record the model version reported by the model service, with a predict response or by the version route.
+
+    Parameters:
+    - version (str): The reported version, None if the service reported none.
+    """
+    global model_version
+    if version and version != model_version:
+        print(f"Model version {version} (was {model_version or DEFAULT_MODEL_VERSION})")
+        model_version = version
+
+def predict_single(model_endpoint, text):
+    """
+    Classify one text with the single predict route of the model service.
+
+    Parameters:
+    - model_endpoint (str): The URL of the single predict route.
+    - text (str): The text to classify.
+
+    Returns:
+    - dict: The model output with "Predicted" and "Score", or None if the request failed.
+    """
+    try:
+        response = get_session().post(model_endpoint, json={"text": text}, timeout=TIMEOUT_SECONDS)
+    except requests.RequestException as e:
+        print("Classification request failed:", e)
+        return None
+    if response.status_code != 200:
+        print("Classification request failed with status", response.status_code)
+        return None
+    note_model_version(response.headers.get('X-Model-Version'))
+    return response.json()
+
+def predict_batch(batch_endpoint, texts):
+    """
+    Classify a list of texts with the batch predict route of the model service.
+
+    Parameters:
+    - batch_endpoint (str): The URL of the batch predict route, which takes {"texts": [...]} and returns
+      the list of model outputs in the same order.
+    - texts (list): The texts to classify.
+
+    Returns:
+    - list: The model outputs, or None if the request failed or the service has no batch route.
+    """
+    global batch_route_available
+    try:
+        response = get_session().post(batch_endpoint, json={"texts": texts}, timeout=TIMEOUT_SECONDS)
+    except requests.RequestException as e:
+        print("Batch classification request failed:", e)
+        return None
+    if response.status_code in MISSING_ROUTE_STATUSES:
+        print("The model service has no batch route, falling back to single requests")
+        batch_route_available = False
+        return None
+    if response.status_code != 200:
+        print("Batch classification request failed with status", response.status_code)
+        return None
+    outputs = response.json()
+    if not isinstance(outputs, list) or len(outputs) != len(texts):
+        print("Batch classification response does not match the batch")
+        return None
+    note_model_version(response.headers.get('X-Model-Version'))
+    return outputs
+
+def predict_texts(texts):
+    """
+    Classify texts in batches sent in parallel, falling back to parallel single requests for the batches
+    that failed, or for every text when the model service has no batch route.
+
+    Parameters:
+    - texts (list): The distinct texts to classify.
+
+    Returns:
+    - dict: The model output of each text, None where the classification failed.
+    """
+    model_endpoint = config['EC2']['URL']
+    batch_endpoint = config.get('EC2', 'BATCH_URL', fallback=None)
+    outputs = {}
+
+    with ThreadPoolExecutor(max_workers=PARALLELISM) as executor:
+        if batch_endpoint and batch_route_available:
+            batches = [texts[i:i + BATCH_SIZE] for i in range(0, len(texts), BATCH_SIZE)]
+            for batch, batch_outputs in zip(batches, executor.map(lambda batch: predict_batch(batch_endpoint, batch), batches)):
+                if batch_outputs is not None:
+                    outputs.update(zip(batch, batch_outputs))
+
+        remaining = [text for text in texts if text not in outputs]
+        outputs.update(zip(remaining, executor.map(lambda text: predict_single(model_endpoint, text), remaining)))
+
+    print(f"Classified {len(texts)} distinct texts, {len(remaining)} with single requests")
+    return outputs
+
+def classify_texts(texts):
+    """
+    Classify texts, answering the ones already classified by the current model version from the classification
+    cache and sending the rest to the model service.
+
+    Parameters:
+    - texts (list): The distinct texts to classify.
+
+    Returns:
+    - dict: The model output of each text, None where the classification failed.
+    """
+    if not CACHE_ENABLED:
+        return predict_texts(texts)
+
+    version = get_model_version()
+    with ThreadPoolExecutor(max_workers=PARALLELISM) as executor:
+        lookups = list(executor.map(lambda text: classification_cache.get(content_key(text, version)), texts))
+    outputs = {text: output for text, (output, found) in zip(texts, lookups) if found}
+
+    predicted = predict_texts([text for text in texts if text not in outputs])
+    # Stored under the version the service reported while predicting, which is the new one after a redeploy
+    version = model_version or version
+    with ThreadPoolExecutor(max_workers=PARALLELISM) as executor:
+        list(executor.map(lambda item: classification_cache.put(content_key(item[0], version), item[1]),
+                          [(text, output) for text, output in predicted.items() if output is not None]))
+    outputs.update(predicted)
+
+    print(f"Classification cache ({version}): {len(texts) - len(predicted)} of {len(texts)} distinct texts cached, "
+          + json.dumps(classification_cache.stats()))
+    return outputs
+
+def prefilter_texts(texts, category, mode=PREFILTER_MODE):
+    """
+    Check texts for a keyword of the category before the model. In drop mode texts without one skip the model,
+    in rank mode they need rank_min_score, and in passthrough mode they are classified as usual and only counted,
+    to measure what drop mode would lose.
+
+    Parameters:
+    - texts (list): The distinct texts to classify.
+    - category (str): The category of the file.
+    - mode (str): 'drop', 'rank', 'passthrough' or 'off'.
+
+    Returns:
+    - tuple: The texts to send to the model, the minimum score of each text, and the set of texts without a keyword.
+    """
+    min_scores = dict.fromkeys(texts, MIN_SCORE)
+    if mode == 'off':
+        return texts, min_scores, set()
+
+    prefilter = get_prefilter(PREFILTER_KEYWORD_BANKS)
+    no_signal = {text for text in texts if not prefilter.has_signal(text, category)}
+    print(f"Prefilter: {len(no_signal)} of {len(texts)} distinct texts have no {category} keyword ({mode})")
+    if mode == 'drop':
+        texts = [text for text in texts if text not in no_signal]
+    elif mode == 'rank':
+        min_scores.update(dict.fromkeys(no_signal, PREFILTER_RANK_MIN_SCORE))
+    return texts, min_scores, no_signal
+
+def classify_and_invoke(messages, file_name, category, bucket_name, stages=None):
     """
     Classify messages using an external model service and invoke another Lambda function
     with the classified messages.
@@ -20,62 +250,56 @@ def classify_and_invoke(messages, file_name, category, bucket_name):
     - file_name (str): The name of the file from which the messages were derived.
     - category (str): The category to match against the predicted category from the model.
     - bucket_name (str): The name of the S3 bucket where the file is stored.
+    - stages (list): The pipeline stages left, data_classification first; data_extract_events follows if omitted.
 
     Returns:
     - dict: Result message indicating the status of the operation.
     """
     try:
-        # Define the endpoint of the model service
-        model_endpoint = config['EC2']['URL']
+        # Classify every distinct non-empty text once
+        texts = [text for text in dict.fromkeys(message.get('message', '').strip() for message in messages) if text]
+
+        # Texts without a single keyword of the category are dropped before the model, held to a higher score or counted
+        texts, min_scores, no_signal = prefilter_texts(texts, category)
+        outputs = classify_texts(texts)
 
-        # Iterate through each message and classify it
         for message in messages:
             # Extract the message text
             text = message.get('message', '').strip()
+            model_output = outputs.get(text)
+
+            # Messages that are empty, dropped by the prefilter or failed to be classified are left without a classification
+            if model_output is not None:
+                # Extract Score and Predicted category from the model's output
+                predicted_category = model_output.get("Predicted", None)
+                score = model_output.get("Score", None)
+
+                # Check if predicted category matches the file category and score is above 0.4
+                if predicted_category == category and score is not None and score >= min_scores[text]:
+                    # Add classification and score to the original message
+                    message['classification'] = predicted_category
+                    message['score'] = score
+                else:
+                    # If predicted category does not match or score is under 0.6, skip inserting it to the message
+                    message['classification'] = None
+                    message['score'] = None
+
+        if PREFILTER_MODE == 'passthrough':
+            kept_without_signal = {message.get('message', '').strip() for message in messages
+                                   if message.get('classification') is not None} & no_signal
+            print(f"Prefilter: the model kept {len(kept_without_signal)} of the {len(no_signal)} texts without a keyword, "
+                  "which drop mode would lose")
 
-            # If the message is not empty, send it to the model for classification
-            if text:
-                # Prepare the payload for the model
-                payload = {"text": text}
-
-                # Send the request to the model service
-                response = requests.post(model_endpoint, json=payload)
-
-                # Process the model's response
-                if response.status_code == 200:
-                    model_output = response.json()
-
-                    # Extract Score and Predicted category from the model's output
-                    predicted_category = model_output.get("Predicted", None)
-                    score = model_output.get("Score", None)
-
-                    # Check if predicted category matches the file category and score is above 0.4
-                    if predicted_category == category and score is not None and score >= 0.4:
-                        # Add classification and score to the original message
-                        message['classification'] = predicted_category
-                        message['score'] = score
-                    else:
-                        # If predicted category does not match or score is under 0.6, skip inserting it to the message
-                        message['classification'] = None
-                        message['score'] = None
-
-        # Prepare payload for the next Lambda function
-        payload = {
+        # Invoke the next stage of the pipeline order (data_extract_events, or data_extract_location when classification runs first)
+        next_stage = invoke_next_stage({
             'file_name': file_name,
             'category': category,
             'bucket_name': bucket_name,
-            'messages': [msg for msg in messages if msg.get('classification') is not None]
-        }
-
-        # Invoke the destination Lambda function
-        lambda_client.invoke(
-            FunctionName='data_extract_events',
-            InvocationType='Event',
-            Payload=json.dumps(payload)
-        )
+            'stages': stages or [CLASSIFICATION_STAGE, EVENTS_STAGE]
+        }, [msg for msg in messages if msg.get('classification') is not None])
 
-        print("Successfully invoked data_extract_events")
-        return {"message": "Successfully invoked data_extract_events"}
+        print("Successfully invoked " + next_stage)
+        return {"message": "Successfully invoked " + next_stage}
     except Exception as e:
         print("Error in classify_and_invoke:", e)
         return {"error": str(e)}
@@ -85,26 +309,33 @@ def lambda_handler(event, context):
     Lambda function handler to process the event and classify messages.
 
     Parameters:
-    - event (dict): The event data containing file_name, messages, category, and bucket_name.
+    - event (dict): The event data containing file_name, messages (or messages_ref, a staged message set), category,
+      bucket_name and the pipeline stages left; or, when classification runs first, the SQS-wrapped S3 notification of a raw file.
     - context (object): The context object provided by AWS Lambda.
 
     Returns:
     - dict: Response object containing status code and result message.
     """
     try:
-        # Extracting object key and messages from the event
-        file_name = event['file_name']
-        messages = event['messages']
-        category = event['category']
-        bucket_name = event['bucket_name']
+        # Extracting object key and messages from the event, or from the raw file it announces
+        stage_input = read_stage_input(event, CLASSIFICATION_STAGE)
+        file_name = stage_input['file_name']
         print("New " + file_name + " upload")
 
-        # Classify messages and invoke data_extract_location
+        # With location first, a raw file delivered here goes to data_extract_location
+        if forward_to_first_stage(stage_input, CLASSIFICATION_STAGE):
+            return {
+                "statusCode": 200,
+                "body": json.dumps({"message": "Forwarded to " + stage_input['stages'][0]})
+            }
+
+        # Classify messages and invoke the next stage
         result = classify_and_invoke(
-            messages,
+            stage_input['messages'],
             file_name,
-            category,  # Pass the category from the event
-            bucket_name
+            stage_input['category'],  # Pass the category from the event
+            stage_input['bucket_name'],
+            stage_input['stages']
         )
 
         return {
@@ -0,0 +1,88 @@
+import argparse
+import contextlib
+import glob
+import io
+import json
+import os
+import time
+
+from lambda_function import generate_message_buckets, MAX_TIME_GAP_HOURS, SCORING_WORKERS, LOCATION_BLOCKING
+
+# Local snapshot of the classified-data-geoshield bucket
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'classified-data-geoshield')
+
+def load_messages(limit):
+    """
+    Load up to `limit` classified messages from the local bucket snapshot.
+
+    Parameters:
+    limit (int): Maximum number of messages to load.
+
+    Returns:
+    list: List of message dictionaries.
+    """
+    messages = []
+    for file_path in sorted(glob.glob(os.path.join(DATA_DIR, '*'))):
+        with open(file_path) as file:
+            try:
+                data = json.load(file)
+            except ValueError:
+                continue
+        # Older GDELT snapshots predate domain_classification and cannot be correlated
+        messages.extend(message for message in data if message.get("message") and message.get("location")
+                        and ("channel_id" in message or "domain_classification" in message))
+        if len(messages) >= limit:
+            break
+    return messages[:limit]
+
+def bucket_pairs(message_buckets):
+    """
+    Collect every (bucket id, member id) pair produced by a correlation run.
+
+    Parameters:
+    message_buckets (dict): Output of generate_message_buckets.
+
+    Returns:
+    set: Set of (bucket id, member id) tuples for buckets with at least one match.
+    """
+    return {(bucket_id, msg["id"]) for bucket_id, bucket in message_buckets.items() if bucket["count"] > 0 for msg in bucket["messages"]}
+
+def run(messages, mode, max_time_gap_hours, workers, location_blocking):
+    """
+    Time a single correlation run, silencing its debug output.
+
+    Parameters:
+    messages (list): List of message dictionaries.
+    mode (str): Correlation mode passed to generate_message_buckets.
+    max_time_gap_hours (float): Time window passed to generate_message_buckets.
+    workers (int): Number of scoring processes passed to generate_message_buckets.
+    location_blocking (bool): Location blocking flag passed to generate_message_buckets.
+
+    Returns:
+    tuple: Elapsed seconds and the produced message buckets.
+    """
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        message_buckets = generate_message_buckets(messages, mode=mode, max_time_gap_hours=max_time_gap_hours, workers=workers,
+                                                   location_blocking=location_blocking)
+    return time.perf_counter() - start, message_buckets
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark generate_message_buckets on local classified data")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[500, 1000])
+    parser.add_argument('--modes', nargs='+', default=['exhaustive', 'lsh'])
+    parser.add_argument('--max-time-gap', type=float, default=MAX_TIME_GAP_HOURS, help="hours; 0 disables the time window")
+    parser.add_argument('--workers', type=int, default=SCORING_WORKERS)
+    parser.add_argument('--location-blocking', choices=['on', 'off'], default='on' if LOCATION_BLOCKING else 'off')
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        messages = load_messages(size)
+        baseline = None
+        for mode in args.modes:
+            elapsed, message_buckets = run(messages, mode, args.max_time_gap, args.workers, args.location_blocking == 'on')
+            pairs = bucket_pairs(message_buckets)
+            if baseline is None:
+                baseline = pairs
+            recall = len(pairs & baseline) / len(baseline) if baseline else 1.0
+            print(f"{len(messages):>6} messages  {mode:<10} {elapsed:8.2f}s  matched pairs: {len(pairs):>5}  recall vs {args.modes[0]}: {recall:.3f}")
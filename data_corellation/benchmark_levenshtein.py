@@ -0,0 +1,76 @@
+import argparse
+import glob
+import json
+import os
+import random
+import time
+
+from lambda_function import (
+    extract_message_features,
+    jaccard_similarity,
+    levenshtein_similarity,
+    score_pair,
+    MIN_SIMILARITY,
+    MAX_SIMILARITY,
+)
+
+# Local snapshot of the maching-events-geoshield bucket
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'maching-events-geoshield')
+
+def load_matched_messages():
+    """
+    Load every message stored in the local matching_messages*.json files.
+
+    Returns:
+    list: List of message dictionaries, with the real length distribution of matched messages.
+    """
+    messages = []
+    for file_path in sorted(glob.glob(os.path.join(DATA_DIR, 'matching_messages*.json'))):
+        with open(file_path) as file:
+            message_buckets = json.load(file)
+        for bucket in message_buckets.values():
+            messages.extend(msg for msg in bucket["messages"] if msg.get("message"))
+    return messages
+
+def full_score(features1, features2):
+    """
+    Score a pair the way correlation did before score_pair: both similarities in full.
+
+    Parameters:
+    features1 (dict): Features of the first message.
+    features2 (dict): Features of the second message.
+
+    Returns:
+    tuple: The Jaccard and Levenshtein similarities if both are in the window, otherwise None.
+    """
+    jaccard_sim = jaccard_similarity(features1, features2)
+    levenshtein_sim = levenshtein_similarity(features1, features2)
+    if MIN_SIMILARITY <= jaccard_sim <= MAX_SIMILARITY and MIN_SIMILARITY <= levenshtein_sim <= MAX_SIMILARITY:
+        return jaccard_sim, levenshtein_sim
+    return None
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Micro-benchmark pair scoring on real matched message lengths")
+    parser.add_argument('--pairs', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    messages = load_matched_messages()
+    features = extract_message_features(messages)
+    lengths = sorted(message_features["length"] for message_features in features)
+    print(f"{len(messages)} messages, length p10/p50/p90/max: "
+          f"{lengths[len(lengths) // 10]}/{lengths[len(lengths) // 2]}/{lengths[len(lengths) * 9 // 10]}/{lengths[-1]}")
+
+    generator = random.Random(args.seed)
+    pairs = [(generator.randrange(len(features)), generator.randrange(len(features))) for _ in range(args.pairs)]
+
+    results = {}
+    for name, scorer in (("full", full_score), ("bounded", score_pair)):
+        start = time.perf_counter()
+        results[name] = [scorer(features[i], features[j]) for i, j in pairs]
+        elapsed = time.perf_counter() - start
+        accepted = sum(result is not None for result in results[name])
+        print(f"{name:<8} {elapsed:7.3f}s  {args.pairs / elapsed:10.0f} pairs/s  accepted: {accepted}")
+
+    mismatches = sum(full != bounded for full, bounded in zip(results["full"], results["bounded"]))
+    print(f"mismatching decisions: {mismatches}")
@@ -1,11 +1,63 @@
 import json
 import boto3
-from simphile import jaccard_similarity
 import Levenshtein
 from datetime import datetime, timedelta
 import uuid as uuid_module
 import traceback
 import re
+import hashlib
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import configparser
+import numpy as np
+from botocore.exceptions import ClientError
+from catalog import get_catalog, make_entry, record_object
+
+# Read configuration from config.ini
+config = configparser.ConfigParser()
+config.read("config.ini")
+
+# Correlation mode: "lsh" compares only MinHash/LSH candidate pairs, "exhaustive" compares every pair
+CORRELATION_MODE = config.get('CORRELATION', 'mode', fallback='lsh')
+MINHASH_NUM_PERM = config.getint('CORRELATION', 'num_perm', fallback=64)
+LSH_BANDS = config.getint('CORRELATION', 'bands', fallback=32)
+# Messages further apart than this many hours are never compared (0 disables the window)
+MAX_TIME_GAP_HOURS = config.getfloat('CORRELATION', 'max_time_gap_hours', fallback=24)
+# Processes used to score blocks of rows (1 scores in-process) and rows per block
+SCORING_WORKERS = config.getint('CORRELATION', 'workers', fallback=1)
+SCORING_BLOCK_SIZE = config.getint('CORRELATION', 'block_size', fallback=256)
+# Regular flow keeps each category's buckets for the day and matches only new files against them
+INCREMENTAL = config.getboolean('CORRELATION', 'incremental', fallback=True)
+# The state is kept out of the output bucket, whose listings are read as matching-event files
+CORRELATION_STATE_BUCKET = config.get('CORRELATION', 'state_bucket', fallback='geoshield-staging')
+CORRELATION_STATE_PREFIX = config.get('CORRELATION', 'state_prefix', fallback='correlation-state/')
+# Invocations correlating the same category and day concurrently redo their merge when the state changed under them
+CORRELATION_STATE_MAX_RETRIES = config.getint('CORRELATION', 'state_max_retries', fallback=5)
+# "all" merges every un-correlated file of the category and day, "newest_two" only the two newest
+CORRELATION_FILES = config.get('CORRELATION', 'files', fallback='all')
+# Concurrent S3 requests when loading and tagging the correlated files
+S3_WORKERS = config.getint('CORRELATION', 's3_workers', fallback=10)
+
+# Only compare messages whose canonical locations share a block; with country spill-over,
+# "City, Country" locations also join the block of their country
+LOCATION_BLOCKING = config.getboolean('CORRELATION', 'location_blocking', fallback=False)
+COUNTRY_SPILLOVER = config.getboolean('CORRELATION', 'country_spillover', fallback=True)
+# Canonical locations that carry no place and are compared with every block
+UNKNOWN_LOCATIONS = {"", "null", "none", "unknown"}
+
+# Conditional writes that lost the race against another invocation
+STATE_CONFLICT_CODES = {"PreconditionFailed", "ConditionalRequestConflict"}
+
+# Message fields kept for bucket seeds in the persisted correlation state
+SEED_FIELDS = ("id", "message", "url", "date", "location", "channel_id", "domain_classification")
+
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+OCCURRENCE_MIX = 0x9E3779B97F4A7C15
+
+# Both similarity scores must fall within this window for two messages to be matched
+MIN_SIMILARITY = 0.3
+MAX_SIMILARITY = 0.7
 
 def load_json_from_s3(bucket_name, file_key):
     """
@@ -22,105 +74,629 @@ def load_json_from_s3(bucket_name, file_key):
     response = s3.get_object(Bucket=bucket_name, Key=file_key)
     return json.loads(response['Body'].read().decode('utf-8'))
 
-def levenshtein_similarity(text1, text2):
+@lru_cache(maxsize=65536)
+def token_hash(token):
+    """
+    Hash a token to a stable 64-bit integer.
+
+    Parameters:
+    token (str): The token to hash.
+
+    Returns:
+    int: The token hash, identical across processes and invocations.
+    """
+    return int.from_bytes(hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest(), 'little')
+
+def extract_message_features(messages):
     """
-    Calculate the Levenshtein similarity between two texts.
+    Compute the similarity features of each message once, when its file is loaded.
+
+    Tokens are split on whitespace like simphile's Jaccard scorer, and repeated tokens
+    are numbered by occurrence so that set operations on the hashes reproduce its
+    multiset Jaccard score exactly.
 
     Parameters:
-    text1 (str): The first text.
-    text2 (str): The second text.
+    messages (list): List of message dictionaries.
+
+    Returns:
+    list: One dictionary per message with the text, its token hashes as a frozenset and its length.
+    """
+    features = []
+    for message in messages:
+        text = message["message"]
+        occurrences = {}
+        tokens = set()
+        for token in text.split():
+            occurrence = occurrences.get(token, 0)
+            occurrences[token] = occurrence + 1
+            tokens.add(token_hash(token) ^ (occurrence * OCCURRENCE_MIX & 0xFFFFFFFFFFFFFFFF))
+        features.append({
+            "text": text,
+            "tokens": frozenset(tokens),
+            "length": len(text)
+        })
+    return features
+
+def jaccard_similarity(features1, features2):
+    """
+    Calculate the Jaccard similarity between two messages from their cached token hashes.
+
+    Parameters:
+    features1 (dict): Features of the first message, from extract_message_features.
+    features2 (dict): Features of the second message, from extract_message_features.
 
     Returns:
     float: Similarity score between 0 and 1.
     """
-    return 1 - Levenshtein.distance(text1, text2) / max(len(text1), len(text2))
+    intersection = len(features1["tokens"] & features2["tokens"])
+    union = len(features1["tokens"]) + len(features2["tokens"]) - intersection
+    return intersection / union if union else 0.0
+
+def levenshtein_similarity(features1, features2):
+    """
+    Calculate the Levenshtein similarity between two messages.
+
+    Parameters:
+    features1 (dict): Features of the first message, from extract_message_features.
+    features2 (dict): Features of the second message, from extract_message_features.
+
+    Returns:
+    float: Similarity score between 0 and 1.
+    """
+    return 1 - Levenshtein.distance(features1["text"], features2["text"]) / max(features1["length"], features2["length"])
+
+def bounded_levenshtein_similarity(features1, features2, min_similarity=MIN_SIMILARITY):
+    """
+    Calculate the Levenshtein similarity between two messages, giving up once it cannot reach min_similarity.
+
+    The distance is computed with a cutoff, so the matrix is only filled within the band
+    that can still yield a similarity of at least min_similarity.
+
+    Parameters:
+    features1 (dict): Features of the first message, from extract_message_features.
+    features2 (dict): Features of the second message, from extract_message_features.
+    min_similarity (float): The lowest similarity of interest.
+
+    Returns:
+    float: Similarity score between 0 and 1, or None if it is below min_similarity.
+    """
+    max_length = max(features1["length"], features2["length"])
+    if max_length == 0:
+        return None
+    max_distance = int((1 - min_similarity) * max_length)
+    distance = Levenshtein.distance(features1["text"], features2["text"], score_cutoff=max_distance)
+    if distance > max_distance:
+        return None
+    return 1 - distance / max_length
+
+def score_pair(features1, features2):
+    """
+    Score a pair of messages, rejecting it from the cheapest bound that rules it out.
+
+    The length ratio bounds the Levenshtein similarity from above, so it is checked first,
+    then the Jaccard similarity, and only then the bounded Levenshtein similarity.
+
+    Parameters:
+    features1 (dict): Features of the first message, from extract_message_features.
+    features2 (dict): Features of the second message, from extract_message_features.
+
+    Returns:
+    tuple: The Jaccard and Levenshtein similarities if both fall within
+           MIN_SIMILARITY and MAX_SIMILARITY, otherwise None.
+    """
+    shorter, longer = sorted((features1["length"], features2["length"]))
+    if longer == 0 or shorter / longer < MIN_SIMILARITY:
+        return None
+
+    jaccard_sim = jaccard_similarity(features1, features2)
+    if not MIN_SIMILARITY <= jaccard_sim <= MAX_SIMILARITY:
+        return None
+
+    levenshtein_sim = bounded_levenshtein_similarity(features1, features2)
+    if levenshtein_sim is None or levenshtein_sim > MAX_SIMILARITY:
+        return None
+
+    return jaccard_sim, levenshtein_sim
+
+def minhash_signature(token_hashes, perm_a, perm_b):
+    """
+    Build the MinHash signature of a message from its token hashes.
+
+    Parameters:
+    token_hashes (frozenset): Token hashes of the message, from extract_message_features.
+    perm_a (numpy.ndarray): Multipliers of the permutation hash functions.
+    perm_b (numpy.ndarray): Offsets of the permutation hash functions.
+
+    Returns:
+    numpy.ndarray: The minimum permuted token hash for each permutation.
+    """
+    if not token_hashes:
+        return np.full(len(perm_a), MAX_HASH, dtype=np.uint64)
+    hashes = np.fromiter(token_hashes, dtype=np.uint64, count=len(token_hashes)) & MAX_HASH
+    permuted = ((np.outer(hashes, perm_a) + perm_b) % MERSENNE_PRIME) & MAX_HASH
+    return permuted.min(axis=0)
+
+def build_lsh_index(features, num_perm=MINHASH_NUM_PERM, bands=LSH_BANDS):
+    """
+    Bucket the MinHash signatures of the messages into LSH bands.
+
+    Parameters:
+    features (list): Features of the messages to be compared, from extract_message_features.
+    num_perm (int): Number of permutations in each MinHash signature.
+    bands (int): Number of bands the signature is split into; must divide num_perm.
+
+    Returns:
+    dict: "buckets", the message indexes of every band bucket as arrays, and
+          "message_buckets", the bucket numbers each message falls into (one per band).
+    """
+    if num_perm % bands != 0:
+        raise ValueError(f"num_perm ({num_perm}) must be a multiple of bands ({bands})")
+    rows = num_perm // bands
+
+    # Fixed seed so that signatures are comparable across invocations
+    generator = np.random.RandomState(1)
+    perm_a = generator.randint(1, int(MERSENNE_PRIME), size=num_perm, dtype=np.uint64)
+    perm_b = generator.randint(0, int(MERSENNE_PRIME), size=num_perm, dtype=np.uint64)
+
+    bucket_numbers = {}  # (band, band signature) -> bucket number
+    bucket_members = []
+    message_buckets = []
+    for index, message_features in enumerate(features):
+        signature = minhash_signature(message_features["tokens"], perm_a, perm_b)
+        numbers = []
+        for band in range(bands):
+            key = (band, signature[band * rows:(band + 1) * rows].tobytes())
+            number = bucket_numbers.setdefault(key, len(bucket_members))
+            if number == len(bucket_members):
+                bucket_members.append([])
+            bucket_members[number].append(index)
+            numbers.append(number)
+        message_buckets.append(numbers)
+
+    return {
+        "buckets": [np.array(members, dtype=np.int64) for members in bucket_members],
+        "message_buckets": message_buckets
+    }
+
+def lsh_candidates(i, lsh_index):
+    """
+    Find the later messages that share at least one LSH band bucket with message i.
+
+    Parameters:
+    i (int): Index of the message.
+    lsh_index (dict): Index built by build_lsh_index.
+
+    Returns:
+    numpy.ndarray: Ascending indexes of the candidate messages.
+    """
+    buckets = lsh_index["buckets"]
+    members = np.unique(np.concatenate([buckets[number] for number in lsh_index["message_buckets"][i]]))
+    return members[members > i]
+
+def parse_message_hours(message):
+    """
+    Parse a message date into hours since the epoch.
+
+    Parameters:
+    message (dict): Message dictionary with a "%Y-%m-%d %H:%M" date.
+
+    Returns:
+    float: The message timestamp in hours.
+    """
+    return datetime.strptime(message["date"], "%Y-%m-%d %H:%M").timestamp() / 3600
+
+def time_window_indexes(timestamp, order, sorted_timestamps, max_time_gap_hours):
+    """
+    Find the messages dated within the maximum time gap of a timestamp.
+
+    Parameters:
+    timestamp (float): Timestamp in hours at the centre of the window.
+    order (numpy.ndarray): Message indexes sorted by timestamp.
+    sorted_timestamps (numpy.ndarray): Message timestamps in the same sorted order.
+    max_time_gap_hours (float): Half-width of the window in hours.
+
+    Returns:
+    numpy.ndarray: Indexes of the messages inside the window, in timestamp order.
+    """
+    lo = np.searchsorted(sorted_timestamps, timestamp - max_time_gap_hours, side='left')
+    hi = np.searchsorted(sorted_timestamps, timestamp + max_time_gap_hours, side='right')
+    return order[lo:hi]
+
+def canonicalize_location(location):
+    """
+    Canonicalize a location string into its most specific place and its country.
+
+    Case, punctuation and a leading "the" are dropped, and only the last line is kept since
+    the extraction model sometimes answers with a sentence before the location. Comma separated
+    locations are read in "City, Country" order.
+
+    Parameters:
+    location (str): The location extracted for the message.
+
+    Returns:
+    tuple: The canonical place, or None if the location is unknown, and the canonical country,
+           or None if the location names a single place.
+    """
+    lines = [line for line in str(location).split('\n') if line.strip()]
+    text = lines[-1].lower() if lines else ""
+    parts = []
+    for part in text.split(','):
+        part = " ".join(re.sub(r"[^\w\s]", " ", part).split())
+        if part.startswith("the "):
+            part = part[4:]
+        if part:
+            parts.append(part)
+    if not parts or parts[0] in UNKNOWN_LOCATIONS:
+        return None, None
+    return parts[0], parts[-1] if len(parts) > 1 else None
+
+def build_location_blocks(messages, country_spillover=COUNTRY_SPILLOVER):
+    """
+    Assign every message to the block of its canonical place and, optionally, of its country.
+
+    Parameters:
+    messages (list): List of message dictionaries with a "location" field.
+    country_spillover (bool): Whether "City, Country" locations also join their country's block.
+
+    Returns:
+    dict: "names", the canonical name of each block; "place" and "country", the block numbers of
+          each message as arrays (-1 for an unknown place, which is compared with every block,
+          or for no country block).
+    """
+    numbers = {}
+    place_blocks = []
+    country_blocks = []
+    for message in messages:
+        place, country = canonicalize_location(message.get("location"))
+        place_blocks.append(numbers.setdefault(place, len(numbers)) if place is not None else -1)
+        if country_spillover and country is not None and country != place:
+            country_blocks.append(numbers.setdefault(country, len(numbers)))
+        else:
+            country_blocks.append(-1)
+    return {
+        "names": list(numbers),
+        "place": np.array(place_blocks, dtype=np.int64),
+        "country": np.array(country_blocks, dtype=np.int64)
+    }
+
+def shares_location_block(i, others, location_blocks):
+    """
+    Check which candidates share a location block with message i.
+
+    Parameters:
+    i (int): Index of the seed message.
+    others (numpy.ndarray): Indexes of the candidate messages.
+    location_blocks (dict): Blocks built by build_location_blocks.
+
+    Returns:
+    numpy.ndarray: Boolean mask over others.
+    """
+    place = location_blocks["place"]
+    country = location_blocks["country"]
+    if place[i] < 0:
+        return np.ones(len(others), dtype=bool)
+    shared = (place[others] < 0) | (place[others] == place[i]) | (country[others] == place[i])
+    if country[i] >= 0:
+        shared |= (place[others] == country[i]) | (country[others] == country[i])
+    return shared
+
+def log_location_block_metrics(block_comparisons, location_blocks, top=10):
+    """
+    Print how many comparisons location blocking avoided, overall and for the largest blocks.
+
+    Parameters:
+    block_comparisons (dict): Block number of the seed's place -> [candidate pairs, compared pairs].
+    location_blocks (dict): Blocks built by build_location_blocks.
+    top (int): Number of blocks to report individually.
+    """
+    candidates = sum(counts[0] for counts in block_comparisons.values())
+    compared = sum(counts[1] for counts in block_comparisons.values())
+    print(f"Location blocking: {len(location_blocks['names'])} blocks, {compared} of {candidates} "
+          f"candidate comparisons kept, {candidates - compared} avoided")
+    largest = sorted(block_comparisons.items(), key=lambda item: item[1][0], reverse=True)[:top]
+    for number, (block_candidates, block_compared) in largest:
+        name = location_blocks["names"][number] if number >= 0 else "<unknown>"
+        print(f"  block '{name}': {block_compared} compared, {block_candidates - block_compared} avoided")
+
+def candidate_indexes(i, state):
+    """
+    List the later messages that message i has to be scored against.
+
+    Parameters:
+    i (int): Index of the seed message.
+    state (dict): Scoring state built by build_scoring_state.
+
+    Returns:
+    numpy.ndarray: Ascending indexes of the candidate messages.
+    """
+    timestamps = state["timestamps"]
+    max_time_gap_hours = state["max_time_gap_hours"]
+    lsh_index = state["lsh_index"]
+    # Seeds of existing buckets were already compared with each other in earlier runs
+    first = max(i + 1, state["first_new"])
+    if lsh_index is not None:
+        others = lsh_candidates(i, lsh_index)
+        others = others[others >= first]
+        if max_time_gap_hours > 0:
+            others = others[np.abs(timestamps[others] - timestamps[i]) <= max_time_gap_hours]
+        return others
+    if max_time_gap_hours > 0:
+        window = time_window_indexes(timestamps[i], state["order"], state["sorted_timestamps"], max_time_gap_hours)
+        return np.sort(window[window >= first])
+    return np.arange(first, len(timestamps), dtype=np.int64)
+
+def build_scoring_state(features, timestamps, lsh_index, max_time_gap_hours, first_new=0, location_blocks=None):
+    """
+    Pack everything the block scorer needs into flat arrays shared by all blocks.
+
+    Token hashes are re-encoded as dense ids in one flat array, so a message's tokens
+    are the slice token_ids[offsets[i]:offsets[i + 1]].
+
+    Parameters:
+    features (list): Features of the messages, from extract_message_features.
+    timestamps (list): Message timestamps in hours.
+    lsh_index (dict): Index built by build_lsh_index, or None to use every later message.
+    max_time_gap_hours (float): Time window in hours; 0 disables it.
+    first_new (int): Index of the first message that is not the seed of an existing bucket.
+    location_blocks (dict): Blocks built by build_location_blocks, or None to compare across locations.
+
+    Returns:
+    dict: The scoring state.
+    """
+    token_arrays = [np.fromiter(message_features["tokens"], dtype=np.uint64, count=len(message_features["tokens"]))
+                    for message_features in features]
+    token_counts = np.array([len(tokens) for tokens in token_arrays], dtype=np.int64)
+    all_tokens = np.concatenate(token_arrays) if token_arrays else np.empty(0, dtype=np.uint64)
+    vocabulary, token_ids = np.unique(all_tokens, return_inverse=True)
+    timestamps = np.array(timestamps, dtype=np.float64)
+    order = np.argsort(timestamps, kind='stable')
+    return {
+        "features": features,
+        "lengths": np.array([message_features["length"] for message_features in features], dtype=np.int64),
+        "token_ids": token_ids.reshape(-1),
+        "token_counts": token_counts,
+        "offsets": np.concatenate(([0], np.cumsum(token_counts))),
+        "vocabulary_size": len(vocabulary),
+        "timestamps": timestamps,
+        "order": order,
+        "sorted_timestamps": timestamps[order],
+        "lsh_index": lsh_index,
+        "max_time_gap_hours": max_time_gap_hours,
+        "first_new": first_new,
+        "location_blocks": location_blocks
+    }
+
+def score_rows(rows, state):
+    """
+    Score a block of seed messages against all their candidates at once.
+
+    For each row the length-ratio and Jaccard bounds are evaluated as array operations
+    over every candidate; only the pairs left over get a bounded Levenshtein distance.
+    Accepted pairs are the same ones score_pair accepts, with the same scores.
+
+    Parameters:
+    rows (range): Indexes of the seed messages in the block.
+    state (dict): Scoring state built by build_scoring_state.
+
+    Returns:
+    tuple: Seed index -> ascending list of (candidate index, Jaccard, Levenshtein) for accepted pairs,
+           and block number of the seed's place -> [candidate pairs, pairs left after location blocking].
+    """
+    features = state["features"]
+    location_blocks = state["location_blocks"]
+    lengths = state["lengths"]
+    token_ids = state["token_ids"]
+    token_counts = state["token_counts"]
+    offsets = state["offsets"]
+    in_row = np.zeros(state["vocabulary_size"], dtype=np.int64)  # 1 for the tokens of the current row
+
+    scores = {}
+    block_comparisons = {}
+    for i in rows:
+        others = candidate_indexes(i, state)
+        if location_blocks is not None:
+            counts = block_comparisons.setdefault(int(location_blocks["place"][i]), [0, 0])
+            counts[0] += len(others)
+            others = others[shares_location_block(i, others, location_blocks)]
+            counts[1] += len(others)
+        if len(others) == 0:
+            continue
+
+        # Length ratio bound on the Levenshtein similarity
+        shorter = np.minimum(lengths[others], lengths[i])
+        longer = np.maximum(lengths[others], lengths[i])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            others = others[(longer > 0) & (shorter / longer >= MIN_SIMILARITY)]
+        if len(others) == 0:
+            continue
+
+        # Jaccard similarity: count each candidate's tokens that also belong to row i
+        row_tokens = token_ids[offsets[i]:offsets[i + 1]]
+        in_row[row_tokens] = 1
+        candidate_tokens = np.concatenate([token_ids[offsets[j]:offsets[j + 1]] for j in others])
+        running = np.concatenate(([0], np.cumsum(in_row[candidate_tokens])))
+        ends = np.cumsum(token_counts[others])
+        intersection = running[ends] - running[ends - token_counts[others]]
+        in_row[row_tokens] = 0
+        union = token_counts[i] + token_counts[others] - intersection
+        with np.errstate(divide='ignore', invalid='ignore'):
+            jaccard = np.where(union > 0, intersection / union, 0.0)
+        in_window = (jaccard >= MIN_SIMILARITY) & (jaccard <= MAX_SIMILARITY)
+
+        accepted = []
+        for j, jaccard_sim in zip(others[in_window].tolist(), jaccard[in_window].tolist()):
+            levenshtein_sim = bounded_levenshtein_similarity(features[i], features[j])
+            if levenshtein_sim is not None and levenshtein_sim <= MAX_SIMILARITY:
+                accepted.append((j, jaccard_sim, levenshtein_sim))
+        if accepted:
+            scores[i] = accepted
+    return scores, block_comparisons
+
+_worker_state = None
+
+def _init_scoring_worker(state):
+    """
+    Keep the scoring state in a pool worker so it is sent once per process, not once per block.
 
-def generate_message_buckets(messages):
+    Parameters:
+    state (dict): Scoring state built by build_scoring_state.
+    """
+    global _worker_state
+    _worker_state = state
+
+def _score_rows_in_worker(rows):
+    """
+    Score a block of rows against the state held by the pool worker.
+
+    Parameters:
+    rows (range): Indexes of the seed messages in the block.
+
+    Returns:
+    tuple: Accepted pairs and location block comparisons, as returned by score_rows.
+    """
+    return score_rows(rows, _worker_state)
+
+def compute_pair_scores(state, workers=SCORING_WORKERS, block_size=SCORING_BLOCK_SIZE):
+    """
+    Compute the accepted pair scores for every message, sharding blocks of rows over processes.
+
+    Parameters:
+    state (dict): Scoring state built by build_scoring_state.
+    workers (int): Number of worker processes; 1 scores in-process.
+    block_size (int): Number of seed messages per block.
+
+    Returns:
+    tuple: Seed index -> ascending list of (candidate index, Jaccard, Levenshtein) for accepted pairs,
+           and the location block comparisons of all blocks, as returned by score_rows.
+    """
+    message_count = len(state["timestamps"])
+    blocks = [range(start, min(start + block_size, message_count)) for start in range(0, message_count, block_size)]
+    scores = {}
+    block_comparisons = {}
+
+    def merge(block_result):
+        block_scores, block_counts = block_result
+        scores.update(block_scores)
+        for number, (candidates, compared) in block_counts.items():
+            counts = block_comparisons.setdefault(number, [0, 0])
+            counts[0] += candidates
+            counts[1] += compared
+
+    if workers > 1 and len(blocks) > 1:
+        try:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_scoring_worker, initargs=(state,)) as executor:
+                for block_result in executor.map(_score_rows_in_worker, blocks):
+                    merge(block_result)
+            return scores, block_comparisons
+        except (OSError, NotImplementedError) as e:
+            # AWS Lambda has no /dev/shm, so process pools are unavailable there
+            print(f"Process pool unavailable ({e}), scoring in-process")
+            scores.clear()
+            block_comparisons.clear()
+    for rows in blocks:
+        merge(score_rows(rows, state))
+    return scores, block_comparisons
+
+def generate_message_buckets(messages, mode=CORRELATION_MODE, max_time_gap_hours=MAX_TIME_GAP_HOURS, features=None,
+                             workers=SCORING_WORKERS, existing_buckets=None, location_blocking=LOCATION_BLOCKING):
     """
     Generate buckets of similar messages based on Jaccard and Levenshtein similarity.
 
     Parameters:
     messages (list): List of message dictionaries to be compared.
+    mode (str): "exhaustive" to score every pair of messages, or "lsh" to score only
+                the pairs sharing a bucket of build_lsh_index.
+    max_time_gap_hours (float): Only messages dated at most this many hours apart are compared;
+                                0 compares messages regardless of their dates.
+    features (list): Features of the messages from extract_message_features; computed here if not given.
+    workers (int): Number of processes scoring blocks of messages; 1 scores in-process.
+    existing_buckets (dict): Buckets from an earlier run, updated in place. Their seeds must be the first
+                             messages, in the same order; new messages are only compared with these
+                             seeds and with each other.
+    location_blocking (bool): Only compare messages whose canonical locations share a block.
 
     Returns:
     dict: A dictionary where keys are message IDs and values are message buckets with similarity scores.
     """
+    if mode not in ("exhaustive", "lsh"):
+        raise ValueError(f"Unknown correlation mode: {mode}")
     message_buckets = {}  # Dictionary to store similar messages
-    assigned_ids = set()  # Set to keep track of IDs already assigned to a group
+    bucket_of = {}  # Message ID -> ID of the bucket it was assigned to
+    bucket_texts = {}  # Bucket ID -> set of message texts already in the bucket
+    first_new = 0
+    if existing_buckets:
+        first_new = len(existing_buckets)
+        for bucket_id, bucket in existing_buckets.items():
+            message_buckets[bucket_id] = bucket
+            bucket_texts[bucket_id] = {msg["message"] for msg in bucket["messages"]}
+            for msg in bucket["messages"]:
+                bucket_of[msg["id"]] = bucket_id
+    if features is None:
+        features = extract_message_features(messages)
+    lsh_index = build_lsh_index(features) if mode == "lsh" else None
+
+    # Parse every date once; the scoring state sorts them so each message's window is a bisect away
+    timestamps = [parse_message_hours(message) for message in messages]
+    location_blocks = build_location_blocks(messages) if location_blocking else None
+    pair_scores, block_comparisons = compute_pair_scores(
+        build_scoring_state(features, timestamps, lsh_index, max_time_gap_hours, first_new, location_blocks), workers)
+    if location_blocks is not None:
+        log_location_block_metrics(block_comparisons, location_blocks)
 
     for i, message1 in enumerate(messages):
-        if message1["id"] not in assigned_ids:
-            # Initialize bucket with the message itself
-            source = "Telegram" if "channel_id" in message1 else "GDELT"
-            message_buckets[message1["id"]] = {
-                "messages": [{
-                    "id": message1["id"],
-                    "message": message1["message"],
-                    "url": message1["url"],
-                    "date": message1["date"],
-                    "source": source
-                }],
-                "location": message1["location"],
-                "total_score": 0,
-                "count": 0
-            }
-            assigned_ids.add(message1["id"])  # Add the current message ID to assigned IDs
-
-            for j, message2 in enumerate(messages):
-                if i != j and message2["id"] not in assigned_ids:  # Skip comparison if i == j or if message2 already assigned to a group
-                    text1 = message1["message"]
-                    text2 = message2["message"]
-                    jaccard_sim = jaccard_similarity(text1, text2)
-                    levenshtein_sim = levenshtein_similarity(text1, text2)
-                    
-                    # Check if the time difference is within 0.5 to 2 hours
-                    date1 = datetime.strptime(message1["date"], "%Y-%m-%d %H:%M")
-                    date2 = datetime.strptime(message2["date"], "%Y-%m-%d %H:%M")
-                    time_diff = abs((date2 - date1).total_seconds()) / 3600  # Difference in hours
-
-                    # Log time difference for debugging
-                    print(f"Time difference between message {i} and message {j}: {time_diff} hours")
-
-                    if 0.3 <= jaccard_sim <= 0.7 and 0.3 <= levenshtein_sim <= 0.7:
-                        # Additional filtering rule for GDELT messages
-                        if "channel_id" not in message1 and "channel_id" not in message2:
-                            domain1 = message1["domain_classification"]
-                            domain2 = message2["domain_classification"]
-
-                            if domain1 == "International" and ("Local" in domain2 or domain2 == "Unknown") and time_diff > 0.5:
-                                continue
-                            elif domain2 == "International" and ("Local" in domain1 or domain1 == "Unknown") and time_diff > 0.5:
-                                continue
-
-                        # Check if message2 already assigned to a group
-                        assigned_to_group = False
-                        for bucket in message_buckets.values():
-                            if message2["id"] in [msg["id"] for msg in bucket["messages"]]:
-                                assigned_to_group = True
-                                break
-
-                        if not assigned_to_group:
-                            # Check for duplicate messages within the current bucket
-                            is_duplicate = False
-                            for msg in message_buckets[message1["id"]]["messages"]:
-                                if msg["message"] == message2["message"]:
-                                    is_duplicate = True
-                                    break
-                            
-                            if not is_duplicate:
-                                source = "Telegram" if "channel_id" in message2 else "GDELT"
-                                message_buckets[message1["id"]]["messages"].append({
-                                    "id": message2["id"],
-                                    "message": message2["message"],
-                                    "url": message2["url"],
-                                    "date": message2["date"],
-                                    "source": source
-                                })
-                                message_buckets[message1["id"]]["total_score"] += (jaccard_sim + levenshtein_sim) / 2
-                                message_buckets[message1["id"]]["count"] += 1
-
-                                # Add message2 ID to assigned_ids
-                                assigned_ids.add(message2["id"])
+        # Seeds of existing buckets keep collecting new messages into their bucket
+        if i < first_new or message1["id"] not in bucket_of:
+            if i >= first_new:
+                # Initialize bucket with the message itself
+                source = "Telegram" if "channel_id" in message1 else "GDELT"
+                message_buckets[message1["id"]] = {
+                    "messages": [{
+                        "id": message1["id"],
+                        "message": message1["message"],
+                        "url": message1["url"],
+                        "date": message1["date"],
+                        "source": source
+                    }],
+                    "location": message1["location"],
+                    "total_score": 0,
+                    "count": 0
+                }
+                bucket_of[message1["id"]] = message1["id"]  # Assign the current message to its own bucket
+                bucket_texts[message1["id"]] = {message1["message"]}
+
+            # Messages before i are already assigned, so only later candidates were scored
+            for j, jaccard_sim, levenshtein_sim in pair_scores.get(i, []):
+                message2 = messages[j]
+                if message2["id"] not in bucket_of:  # Skip message2 if already assigned to a group
+                    # Time difference used by the GDELT domain rule
+                    time_diff = abs(timestamps[j] - timestamps[i])  # Difference in hours
+
+                    # Additional filtering rule for GDELT messages
+                    if "channel_id" not in message1 and "channel_id" not in message2:
+                        domain1 = message1["domain_classification"]
+                        domain2 = message2["domain_classification"]
+
+                        if domain1 == "International" and ("Local" in domain2 or domain2 == "Unknown") and time_diff > 0.5:
+                            continue
+                        elif domain2 == "International" and ("Local" in domain1 or domain1 == "Unknown") and time_diff > 0.5:
+                            continue
+
+                    # Skip messages whose text is already in the current bucket
+                    if message2["message"] not in bucket_texts[message1["id"]]:
+                        source = "Telegram" if "channel_id" in message2 else "GDELT"
+                        message_buckets[message1["id"]]["messages"].append({
+                            "id": message2["id"],
+                            "message": message2["message"],
+                            "url": message2["url"],
+                            "date": message2["date"],
+                            "source": source
+                        })
+                        message_buckets[message1["id"]]["total_score"] += (jaccard_sim + levenshtein_sim) / 2
+                        message_buckets[message1["id"]]["count"] += 1
+
+                        # Index message2 under the current bucket
+                        bucket_of[message2["id"]] = message1["id"]
+                        bucket_texts[message1["id"]].add(message2["message"])
 
     # Calculate average score for each bucket
     for bucket in message_buckets.values():
@@ -133,6 +709,149 @@ def generate_message_buckets(messages):
 
 
 
+def correlation_state_key(category, day):
+    """
+    Build the S3 key of the persisted correlation state for a category and day.
+
+    Parameters:
+    category (str): The category of the correlated files.
+    day (str): The day in '%Y-%m-%d' format.
+
+    Returns:
+    str: The key of the state object in the state bucket.
+    """
+    return f"{CORRELATION_STATE_PREFIX}{category}_{day}.json"
+
+def load_correlation_state(s3, category, day, bucket_name=CORRELATION_STATE_BUCKET):
+    """
+    Load the correlation state of a category and day, or an empty state if none was saved yet.
+
+    Parameters:
+    s3 (botocore.client.S3): The S3 client.
+    category (str): The category of the correlated files.
+    day (str): The day in '%Y-%m-%d' format.
+    bucket_name (str): The name of the bucket holding the state.
+
+    Returns:
+    tuple: The state, with "seeds", the seed messages of the buckets in bucket order, and "buckets", every bucket
+    of the day; and the ETag of the state object, None if none was saved yet.
+    """
+    try:
+        response = s3.get_object(Bucket=bucket_name, Key=correlation_state_key(category, day))
+    except s3.exceptions.NoSuchKey:
+        return {"seeds": [], "buckets": {}}, None
+    state = json.loads(response['Body'].read().decode('utf-8'))
+    print(f"Loaded correlation state with {len(state['buckets'])} buckets")
+    return state, response['ETag']
+
+def save_correlation_state(s3, category, day, messages, message_buckets, etag, bucket_name=CORRELATION_STATE_BUCKET):
+    """
+    Persist the buckets of a category and day together with their seed messages, only if the state is still
+    the one that was loaded.
+
+    Parameters:
+    s3 (botocore.client.S3): The S3 client.
+    category (str): The category of the correlated files.
+    day (str): The day in '%Y-%m-%d' format.
+    messages (list): The messages passed to generate_message_buckets, seeds included.
+    message_buckets (dict): Every bucket returned by generate_message_buckets.
+    etag (str): The ETag of the loaded state, None if there was none.
+    bucket_name (str): The name of the bucket holding the state.
+
+    Returns:
+    bool: True if the state was saved, False if another invocation saved it since it was loaded.
+    """
+    messages_by_id = {}
+    for message in messages:
+        messages_by_id.setdefault(message["id"], message)
+    seeds = [{field: messages_by_id[bucket_id][field] for field in SEED_FIELDS if field in messages_by_id[bucket_id]}
+             for bucket_id in message_buckets]
+    # Overwrite only the version that was loaded, create only if there was none
+    condition = {"IfMatch": etag} if etag else {"IfNoneMatch": "*"}
+    try:
+        s3.put_object(
+            Bucket=bucket_name,
+            Key=correlation_state_key(category, day),
+            Body=json.dumps({"seeds": seeds, "buckets": message_buckets}),
+            **condition
+        )
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') in STATE_CONFLICT_CODES:
+            return False
+        raise
+    return True
+
+def correlate_incremental(s3, category, day, messages, features):
+    """
+    Match new messages against the buckets already built for a category and day, then against each other, and
+    persist the result. A merge that lost the race against another invocation is redone on the newer state.
+
+    Parameters:
+    s3 (botocore.client.S3): The S3 client.
+    category (str): The category of the correlated files.
+    day (str): The day in '%Y-%m-%d' format.
+    messages (list): The messages of the new files.
+    features (list): The features of the messages, as returned by extract_message_features.
+
+    Returns:
+    dict: Every bucket of the day.
+    """
+    for attempt in range(CORRELATION_STATE_MAX_RETRIES + 1):
+        state, etag = load_correlation_state(s3, category, day)
+        all_messages = state["seeds"] + messages
+        all_features = extract_message_features(state["seeds"]) + features
+        message_buckets = generate_message_buckets(all_messages, features=all_features, existing_buckets=state["buckets"])
+        if save_correlation_state(s3, category, day, all_messages, message_buckets, etag):
+            return message_buckets
+        print(f"Correlation state of {category} {day} changed since it was loaded, merging again (attempt {attempt + 1})")
+    raise RuntimeError(f"Correlation state of {category} {day} kept changing, giving up after "
+                       f"{CORRELATION_STATE_MAX_RETRIES + 1} attempts")
+
+def load_files(bucket_name, file_keys):
+    """
+    Load several JSON files from an S3 bucket concurrently, each one exactly once.
+
+    Parameters:
+    bucket_name (str): The name of the S3 bucket.
+    file_keys (list): The keys of the files to load.
+
+    Returns:
+    list: The parsed JSON data of each file, in the order of file_keys.
+    """
+    with ThreadPoolExecutor(max_workers=S3_WORKERS) as executor:
+        return list(executor.map(lambda file_key: load_json_from_s3(bucket_name, file_key), file_keys))
+
+def tag_correlated_files(s3, bucket_name, file_keys, category):
+    """
+    Add the 'Corellation_flag' tag to every consumed file in one concurrent batch.
+
+    Parameters:
+    s3 (botocore.client.S3): The S3 client.
+    bucket_name (str): The name of the S3 bucket.
+    file_keys (list): The keys of the consumed files.
+    category (str): The category tag the files keep.
+    """
+    def tag_file(file_key):
+        s3.put_object_tagging(
+            Bucket=bucket_name,
+            Key=file_key,
+            Tagging={
+                'TagSet': [
+                    {
+                        'Key': 'Category',
+                        'Value': category
+                    },
+                    {
+                        'Key': 'Corellation_flag',
+                        'Value': 'True'
+                    }
+                ]
+            }
+        )
+
+    with ThreadPoolExecutor(max_workers=S3_WORKERS) as executor:
+        list(executor.map(tag_file, file_keys))
+
 def upload_to_s3(bucket_name, file_key, file_path):
     """
     Upload a file to an S3 bucket.
@@ -230,51 +949,54 @@ def lambda_handler(event, context):
                 'body': json.dumps({"error": "Category tag not found in the S3 object"})
             }
         
-        # List all objects in the bucket
-        response = s3.list_objects_v2(Bucket=input_bucket_name)
-
-        # Filter objects based on the 'Category' tag
-        filtered_objects = []
-        today_date = datetime.now().strftime('%Y-%m-%d')
-        for obj in response.get('Contents', []):
-            obj_key = obj['Key']
-            obj_tags = s3.get_object_tagging(Bucket=input_bucket_name, Key=obj_key)['TagSet']
-            for tag in obj_tags:
-                if tag['Key'] == 'Category' and tag['Value'] == category:
-                    last_modified = obj['LastModified'].strftime('%Y-%m-%d')
-                    if last_modified == today_date:
-                        if no_has_corellation_flag(obj_tags):
-                            filtered_objects.append(obj_key)
-                            print("filtered_objects.append "+ obj_key)
-                    break
-
-        # Ensure at least two files are found for the specified category and date
-        if len(filtered_objects) < 2:
-            print("Less than two files found for the specified category, date and corellation flag")
+        catalog = get_catalog()
+        if input_bucket_name == "classified-data-geoshield":
+            # Look up today's un-correlated files of the category in the catalog, oldest first
+            today_date = datetime.now().strftime('%Y-%m-%d')
+            filtered_entries = catalog.find(input_bucket_name, category, today_date, today_date, correlated=False)
+        else:
+            # The un-correlated files of the custom request that triggered the invocation, by the UUID of its keys
+            filtered_entries = [entry for entry in catalog.find_by_uuid(input_bucket_name, extract_uuid(file_name))
+                                if entry['category'] == category and not entry['correlated']]
+        # The file that triggered the invocation is always correlated, even if its catalog entry is missing
+        tag_keys = [tag['Key'] for tag in tags['TagSet']]
+        if 'Corellation_flag' not in tag_keys and file_name not in [entry['key'] for entry in filtered_entries]:
+            print("Triggering file missing from the catalog, recording it: " + file_name)
+            trigger_entry = make_entry(input_bucket_name, file_name, category)
+            catalog.put(trigger_entry)
+            filtered_entries.append(trigger_entry)
+        filtered_objects = [entry['key'] for entry in filtered_entries]
+        print("filtered_objects: " + str(filtered_objects))
+
+        # A single new file can still be matched against the buckets already built today
+        incremental = INCREMENTAL and input_bucket_name == "classified-data-geoshield"
+        min_files = 1 if incremental and CORRELATION_FILES == "all" else 2
+        if len(filtered_objects) < min_files:
+            print("Not enough files found for the specified category, date and corellation flag")
             return {
                 'statusCode': 400,
-                'body': json.dumps({"error": "Less than two files found for the specified category, date and corellation flag"})
+                'body': json.dumps({"error": "Not enough files found for the specified category, date and corellation flag"})
             }
 
-        # Sort files by last modified date in descending order
-        filtered_objects.sort(key=lambda x: s3.head_object(Bucket=input_bucket_name, Key=x)['LastModified'], reverse=True)
-
-        # Select the newest two files
-        newest_files = filtered_objects[:2]
-
-        # Load JSON files from S3
-        gdelt_file_key = newest_files[0]
-        telegram_file_key = newest_files[1]
-        print("gdelt_file_key: " + gdelt_file_key)
-        print("telegram_file_key: " + telegram_file_key)
-        gdelt_messages = load_json_from_s3(input_bucket_name, gdelt_file_key)
-        telegram_messages = load_json_from_s3(input_bucket_name, telegram_file_key)
+        # Select every un-correlated file of the day (regular flow) or of the request (custom flow), or only the newest two
+        consumed_entries = filtered_entries if CORRELATION_FILES == "all" else filtered_entries[-2:]
+        consumed_files = [entry['key'] for entry in consumed_entries]
+        print("consumed_files: " + str(consumed_files))
 
-        # Combine all messages for comparison
-        all_messages = telegram_messages + gdelt_messages
+        # Load every file once; the source of each message is detected from its fields
+        all_messages = []
+        all_features = []
+        for file_messages in load_files(input_bucket_name, consumed_files):
+            all_messages.extend(file_messages)
+            all_features.extend(extract_message_features(file_messages))
         
-        # Generate message buckets
-        message_buckets = generate_message_buckets(all_messages)
+        if incremental:
+            # Match the new files against the buckets already built today, then against each other
+            today = datetime.now().strftime('%Y-%m-%d')
+            message_buckets = correlate_incremental(s3, category, today, all_messages, all_features)
+        else:
+            # Generate message buckets
+            message_buckets = generate_message_buckets(all_messages, features=all_features)
         
 
         # Filter out buckets with count == 0
@@ -295,31 +1017,19 @@ def lambda_handler(event, context):
             file_exists_today = False
             matching_category = None
             
-            # List all files in the S3 bucket
-            response = s3.list_objects_v2(Bucket=output_bucket_name)
-            
-            # Check if any file matches today's date and category
-            for obj in response.get('Contents', []):
-                file_key = obj['Key']
-                last_modified = obj['LastModified'].strftime('%Y-%m-%d')
-                last_modified_with_time = obj['LastModified'].strftime('%Y-%m-%d %H:%M')  # Printing last modified date with current hour and minute
-                print("Last modified date with time for file", file_key + ":", last_modified_with_time)
-                # Check if the file's last modified date matches today's date
-                if today == last_modified:
-                    response_tags = s3.get_object_tagging(Bucket=output_bucket_name, Key=file_key)
-                    print("found file: "+ file_key)
-                    for tag in response_tags['TagSet']:
-                        # Check if the file's category matches the event's category
-                        if tag['Key'] == 'Category':
-                            if tag['Value'] == category:
-                                file_exists_today = True
-                                break
-                if file_exists_today:
-                    break
+            # Look up today's matching file of the category in the catalog
+            for entry in catalog.find(output_bucket_name, category, today, today):
+                file_key = entry['key']
+                print("found file: "+ file_key)
+                file_exists_today = True
+                break
             
             # If a matching file exists, append new information to it
             if file_exists_today:
     
+                # Record the file in the catalog before the put, so the invocation the put triggers finds it
+                record_object(output_bucket_name, file_key, category)
+
                 # Upload the updated content back to S3
                 s3.put_object(Bucket=output_bucket_name, Key=file_key, Body=json.dumps(filtered_buckets))
                 
@@ -341,6 +1051,8 @@ def lambda_handler(event, context):
             else:
                 file_name = f'matching_messages_{new_uuid}.json'
                 # Proceed with regular process of saving processed messages as a new file in S3
+                # Record the file in the catalog before the put, so the invocation the put triggers finds it
+                record_object(output_bucket_name, file_name, category)
                 s3.put_object(Bucket=output_bucket_name, Key=file_name, Body=json.dumps(filtered_buckets))
                 # Add category tag to the file in S3
                 s3.put_object_tagging(
@@ -357,10 +1069,13 @@ def lambda_handler(event, context):
                 )
                 print("New file data  " + file_name + " processed and saved successfully!")
         else:
-                uuid=extract_uuid(telegram_file_key)
+                # The output is named after the request, which get_jsons queries by its UUID
+                uuid=extract_uuid(file_name)
                 print(uuid)
                 file_name = f'matching_messages_{str(uuid)}.json'
                 # Proceed with regular process of saving processed messages as a new file in S3
+                # Record the file in the catalog before the put, so the invocation the put triggers finds it
+                record_object(output_bucket_name, file_name, category)
                 s3.put_object(Bucket=output_bucket_name, Key=file_name, Body=json.dumps(filtered_buckets))
                 # Add category tag to the file in S3
                 s3.put_object_tagging(
@@ -377,40 +1092,9 @@ def lambda_handler(event, context):
                 )
                 print("New file data  " + file_name + " processed and saved successfully!")
         
-        # ADD 'Corellation_flag' tag from files
-        s3.put_object_tagging(
-            Bucket=input_bucket_name,
-            Key=telegram_file_key,
-            Tagging={
-                'TagSet': [
-                    {
-                        'Key': 'Category',
-                        'Value': category
-                    },
-                    {
-                        'Key': 'Corellation_flag',
-                        'Value': 'True'
-                    }
-                ]
-            }
-        )
-        
-        s3.put_object_tagging(
-            Bucket=input_bucket_name,
-            Key=gdelt_file_key,
-            Tagging={
-                'TagSet': [
-                    {
-                        'Key': 'Category',
-                        'Value': category
-                    },
-                    {
-                        'Key': 'Corellation_flag',
-                        'Value': 'True'
-                    }
-                ]
-            }
-        )
+        # ADD 'Corellation_flag' tag to every consumed file
+        tag_correlated_files(s3, input_bucket_name, consumed_files, category)
+        catalog.set_correlated(consumed_entries)
 
         print("Matching messages processed successfully and stored in maching-events-geoshield bucket")
         return {
@@ -1,80 +1,52 @@
 import json
 import boto3
-import concurrent.futures
+import asyncio
 from datetime import datetime
-import requests
 import traceback
+from catalog import get_catalog, record_object
+from llm_client import AsyncLLMClient, get_rate_controller
+from secret_store import get_secrets
+from claim_check import load_messages
 
-# AWS Secrets Manager client
-secrets_client = boto3.client('secretsmanager')
-
-# Secrets Manager configuration
+# Secrets Manager names of the AI21 credentials, fetched on first use
 endpoint_secret_name = "ai_api_endpoint"
 api_secret_name = "ai_api_secrets"
-region_name = "eu-west-1"
-
-# Fetching the endpoint from AWS Secrets Manager
-get_secret_value_response = secrets_client.get_secret_value(
-    SecretId=endpoint_secret_name
-)
-secret = json.loads(get_secret_value_response['SecretString'])
-endpoint = secret['ai_endpoint']
-
-# Fetching the API key from AWS Secrets Manager
-get_secret_value_response = secrets_client.get_secret_value(
-    SecretId=api_secret_name
-)
-secret = json.loads(get_secret_value_response['SecretString'])
-api_key = secret['api_key']
-
-def generate_text(message, question):
+
+def llm_credentials():
+    """
+    Returns the AI21 endpoint and API key, fetched from AWS Secrets Manager on first use.
+
+    Returns:
+        tuple: The endpoint and the API key.
+    """
+    endpoint_secret, api_secret = get_secrets(endpoint_secret_name, api_secret_name)
+    return endpoint_secret['ai_endpoint'], api_secret['api_key']
+
+async def generate_text(client, message, question):
     """
     Generates a response from the AI21 API based on the provided message and question.
 
     Args:
+        client (AsyncLLMClient): The open LLM client of the invocation.
         message (str): The message to be analyzed.
         question (str): The question to be asked to the AI21 API.
 
     Returns:
-        str: The generated text from the AI21 API response.
+        str or None: The generated text from the AI21 API response, or None if the request failed.
     """
-    prompt = message + question
-    # Request headers
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json",
-    }
-    # Request payload
-    request_body = {
-        "prompt": prompt,
-        "maxTokens": 250,  # Specify the maximum number of tokens in the generated completion
-    }
-    
-    # Send the request to the AI21 API
-    response = requests.post(endpoint, data=json.dumps(request_body), headers=headers)
-    
-    # Parse the response JSON
-    response_json = response.json()
-    
-    # Initialize generated_text
-    generated_text = ""
-    # Check if 'completions' key exists in the response
-    if 'completions' in response_json:
-        # Extract the generated text from the response
-        generated_text = response_json['completions'][0]['data']['text']
-        # Clean up the response text
-        generated_text = generated_text.strip()
+    generated_text = await client.complete(message + question, 250)
         
     # Print the cleaned location
     print(f"event_breakdown: {generated_text}")
     
     return generated_text
 
-def process_message(message, category):
+async def process_message(client, message, category):
     """
     Processes a single message to extract current events relevant to the specified category.
 
     Args:
+        client (AsyncLLMClient): The open LLM client of the invocation.
         message (dict): The message containing the event details.
         category (str): The category of the event to be identified.
 
@@ -92,7 +64,12 @@ def process_message(message, category):
         attempt_count = 0
         
         while attempt_count < max_attempts:
-            event_breakdown = generate_text(message["message"], event_breakdown_question)
+            event_breakdown = await generate_text(client, message["message"], event_breakdown_question)
+
+            # The client already retried the request, a failure is not retried as an empty answer
+            if event_breakdown is None:
+                attempt_count = max_attempts
+                break
             
             # Check if the event_breakdown is meaningful, not empty
             if event_breakdown != "":
@@ -109,6 +86,25 @@ def process_message(message, category):
             
     return message
 
+async def process_messages(messages, category):
+    """
+    Processes every message without an event_breakdown concurrently in a single event loop, over one pooled LLM client.
+
+    Args:
+        messages (list): The messages containing the event details.
+        category (str): The category of the events to be identified.
+
+    Returns:
+        list: The messages with the added 'event_breakdown' key.
+    """
+    # Messages whose events were extracted with their location in the combined pass are not sent again
+    pending = [message for message in messages if not message.get("event_breakdown")]
+    print(f"{len(messages) - len(pending)} messages carry their event_breakdown from the combined pass")
+    if pending:
+        async with AsyncLLMClient(*llm_credentials()) as client:
+            await asyncio.gather(*(process_message(client, message, category) for message in pending))
+    return messages
+
 def compare_first_two_words(file1, file2):
     """
     Compares the first two words of two file names to check for a match.
@@ -169,7 +165,8 @@ def lambda_handler(event, context):
         
         category = event['category']
         file_name = event['file_name']
-        messages = event['messages']
+        # Inline, or streamed from the staging object of a large set
+        messages = load_messages(event)
         today = datetime.now().strftime('%Y-%m-%d')
         today_with_time = datetime.now().strftime('%Y-%m-%d %H:%M')  # Printing today's date with current hour and minute
         print("Today's date with time:", today_with_time)
@@ -178,40 +175,22 @@ def lambda_handler(event, context):
 
         print("Extracting data from " + file_name + " started")
 
-        # Define the maximum number of workers for concurrent processing
-        max_workers = 10
-
         # Process messages concurrently
-        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-            processed_messages = list(executor.map(process_message, messages, [category] * len(messages)))
+        processed_messages = asyncio.run(process_messages(messages, category))
+        print("LLM requests: " + json.dumps(get_rate_controller().stats()))
 
         # Filter out messages with 'null' (in any case) in event_breakdown
         filtered_messages = [msg for msg in processed_messages if "null" not in msg["event_breakdown"].lower()]
 
         if bucket_name == 'classified-data-geoshield':
-            # List all files in the S3 bucket
-            response = s3.list_objects_v2(Bucket=bucket_name)
-
-            # Check if any file matches today's date and category
-            for obj in response.get('Contents', []):
-                file_key = obj['Key']
-                last_modified = obj['LastModified'].strftime('%Y-%m-%d')
-                last_modified_with_time = obj['LastModified'].strftime('%Y-%m-%d %H:%M')  # Printing last modified date with current hour and minute
-                print("Last modified date with time for file", file_key + ":", last_modified_with_time)
-                # Check if the file's last modified date matches today's date
-                if today == last_modified:
-                    if compare_first_two_words(file_key, file_name):
-                        response_tags = s3.get_object_tagging(Bucket=bucket_name, Key=file_key)
-                        print("found file: " + file_key)
-                        for tag in response_tags['TagSet']:
-                            print(tag)
-                            # Check if the file's category matches the event's category
-                            if tag['Key'] == 'Category':
-                                if tag['Value'] == event['category']:
-                                    file_exists_today = True
-                                    matching_category = tag['Value']
-                                    break
-                if file_exists_today:
+            # Look up today's files of the category in the catalog
+            for entry in get_catalog().find(bucket_name, category, today, today):
+                file_key = entry['key']
+                print("Catalog file for today:", file_key, entry['updated_at'])
+                if compare_first_two_words(file_key, file_name):
+                    print("found file: " + file_key)
+                    file_exists_today = True
+                    matching_category = entry['category']
                     break
 
             # If a matching file exists, append new information to it
@@ -225,6 +204,9 @@ def lambda_handler(event, context):
                 all_message = existing_messages + filtered_messages
                 updated_messages = remove_duplicate_urls(all_message)
 
+                # Record the file in the catalog before the put, so the invocation the put triggers finds it
+                record_object(bucket_name, file_key, category)
+
                 # Upload the updated content back to S3
                 s3.put_object(Bucket=bucket_name, Key=file_key, Body=json.dumps(updated_messages))
 
@@ -245,6 +227,8 @@ def lambda_handler(event, context):
 
             else:
                 # Proceed with regular process of saving processed messages as a new file in S3
+                # Record the file in the catalog before the put, so the invocation the put triggers finds it
+                record_object(bucket_name, file_name, category)
                 s3.put_object(Bucket=bucket_name, Key=file_name, Body=json.dumps(filtered_messages))
                 # Add category tag to the file in S3
                 s3.put_object_tagging(
@@ -263,6 +247,8 @@ def lambda_handler(event, context):
 
         else:
             # Proceed with regular process of saving processed messages as a new file in S3
+            # Record the file in the catalog before the put, so the invocation the put triggers finds it
+            record_object(bucket_name, file_name, category)
             s3.put_object(Bucket=bucket_name, Key=file_name, Body=json.dumps(filtered_messages))
             # Add category tag to the file in S3
             s3.put_object_tagging(
@@ -1,187 +1,519 @@
-import requests
+import asyncio
 import json
-import concurrent.futures
-import boto3
 import traceback
+import re
 from botocore.exceptions import ClientError
+import configparser
+from result_cache import TwoTierCache, content_key, make_store
+from near_duplicates import group_near_duplicates
+from llm_client import AsyncLLMClient, get_rate_controller
+from secret_store import get_secrets
+from pipeline import CLASSIFICATION_STAGE, LOCATION_STAGE, forward_to_first_stage, invoke_next_stage, read_stage_input
 
-# AWS Secrets Manager client
-secrets_client = boto3.client('secretsmanager', region_name='eu-west-1')
+# Read configuration from config.ini
+config = configparser.ConfigParser()
+config.read("config.ini")
 
-# Retrieve secrets from AWS Secrets Manager
+CACHE_ENABLED = config.getboolean('LOCATION_CACHE', 'enabled', fallback=True)
+PROMPT_VERSION = config.get('LOCATION_CACHE', 'prompt_version', fallback='1')
+
+BATCH_ENABLED = config.getboolean('LOCATION_BATCH', 'enabled', fallback=True)
+BATCH_MAX_MESSAGES = config.getint('LOCATION_BATCH', 'max_messages', fallback=20)
+BATCH_MAX_PROMPT_TOKENS = config.getint('LOCATION_BATCH', 'max_prompt_tokens', fallback=2000)
+BATCH_ANSWER_TOKENS = config.getint('LOCATION_BATCH', 'answer_tokens_per_message', fallback=16)
+
+NEAR_DUPLICATES_ENABLED = config.getboolean('NEAR_DUPLICATES', 'enabled', fallback=True)
+NEAR_DUPLICATES_MAX_DISTANCE = config.getint('NEAR_DUPLICATES', 'max_distance', fallback=3)
+NEAR_DUPLICATES_SHINGLE_SIZE = config.getint('NEAR_DUPLICATES', 'shingle_size', fallback=3)
+
+COMBINED_ENABLED = config.getboolean('COMBINED', 'enabled', fallback=False)
+COMBINED_EVENT_TOKENS = config.getint('COMBINED', 'event_tokens', fallback=250)
+
+# Secrets Manager names of the AI21 credentials, fetched on first use
 api_secret_name = "ai_api_secrets"
 endpoint_secret_name = "ai_api_endpoint"
 
-# Fetch API key
-get_api_secret_value_response = secrets_client.get_secret_value(
-    SecretId=api_secret_name
+# Location cache shared by the invocations of this container and, through the store, by all containers
+location_cache = TwoTierCache(
+    store=make_store(
+        config.get('LOCATION_CACHE', 'store', fallback='none'),
+        bucket=config.get('LOCATION_CACHE', 'bucket', fallback='geoshield-cache'),
+        prefix=config.get('LOCATION_CACHE', 'prefix', fallback='location-cache/'),
+        path=config.get('LOCATION_CACHE', 'path', fallback='/tmp/geoshield_cache/location')
+    ),
+    max_entries=config.getint('LOCATION_CACHE', 'memory_entries', fallback=10000),
+    ttl_seconds=config.getfloat('LOCATION_CACHE', 'ttl_hours', fallback=720) * 3600,
+    negative_ttl_seconds=config.getfloat('LOCATION_CACHE', 'negative_ttl_hours', fallback=24) * 3600
 )
-api_secret = json.loads(get_api_secret_value_response['SecretString'])
-api_key = api_secret['api_key']
 
-# Fetch API endpoint
-get_endpoint_secret_value_response = secrets_client.get_secret_value(
-    SecretId=endpoint_secret_name
-)
-endpoint_secret = json.loads(get_endpoint_secret_value_response['SecretString'])
-endpoint = endpoint_secret['ai_endpoint']
+LOCATION_QUESTION = "Based on the information in the text, please identify the main location where the main event takes place. Choose only one location that accurately represents the main focus of the event. Be sure to find the most specific location (eg city and state and not just a country and so on). (Answer in English Only the location you found. Answer for example: 'ODESA', note that there may not be a central event that can be placed on a map - if you cannot determine a specific location, answer only the exact word- null without any additions to the word"
+
+BATCH_LOCATION_QUESTION = "For each numbered text above, identify the main location where the main event takes place. Choose only one location per text that accurately represents the main focus of its event. Be sure to find the most specific location (eg city and state and not just a country and so on). Answer in English with exactly one line per text, in the same order, in the format '<number>. Location: <location>', for example: '1. Location: ODESA'. If you cannot determine a specific location for a text, answer '<number>. Location: null' for it"
+
+# The event part follows the event_breakdown question of data_extract_events
+COMBINED_QUESTION = " Based on the information in the text above, answer two questions in English, in exactly this format: first a line 'Location: <location>' with the main location where the main event takes place - choose only one location that accurately represents the main focus of the event, the most specific one (eg city and state and not just a country and so on), or 'Location: null' if there is no central event that can be placed on a map. Then 'Events: ' followed by the list of only current events of {category} that are reported in the text that can be placed on a map (ie, have a specific location), each formatted as a short report in English. Note the target event - a news push that reports an event that is happening in the current time frame and belongs to the category {category}, and not a past event. If no relevant events were found, answer 'Events: null'."
+
+def llm_credentials():
+    """
+    Returns the AI21 endpoint and API key, fetched from AWS Secrets Manager on first use.
+
+    Returns:
+        tuple: The endpoint and the API key.
+    """
+    api_secret, endpoint_secret = get_secrets(api_secret_name, endpoint_secret_name)
+    return endpoint_secret['ai_endpoint'], api_secret['api_key']
+
+def parse_location(generated_text):
+    """
+    Extracts the location from a generated answer.
+
+    Args:
+        generated_text (str): The generated answer.
+
+    Returns:
+        str: The location after 'Location:', or 'null'.
+    """
+    # Check if the response contains 'Location:null'
+    if 'Location:null' in generated_text:
+        return 'null'
+    # Extract location after 'Location:'
+    return generated_text.split('Location:')[-1].strip() if generated_text else 'null'
+
+def estimate_tokens(text):
+    """
+    Estimates the number of tokens of a text, at roughly four characters per token.
+
+    Args:
+        text (str): The text to be measured.
+
+    Returns:
+        int: The estimated number of tokens.
+    """
+    return len(text) // 4 + 1
+
+def plan_batches(texts, max_messages=BATCH_MAX_MESSAGES, max_prompt_tokens=BATCH_MAX_PROMPT_TOKENS):
+    """
+    Splits texts into consecutive batches that fit the token budget of one prompt.
 
-def generate_text(message, question):
+    Args:
+        texts (list): The texts to be analyzed.
+        max_messages (int): The maximum number of texts in a batch.
+        max_prompt_tokens (int): The estimated token budget of a batch prompt, question included.
+
+    Returns:
+        list: Lists of indexes into texts; a text over the budget on its own gets a batch of one.
+    """
+    budget = max_prompt_tokens - estimate_tokens(BATCH_LOCATION_QUESTION)
+    batches = []
+    batch = []
+    batch_tokens = 0
+    for i, text in enumerate(texts):
+        tokens = estimate_tokens(text) + 2
+        if batch and (len(batch) >= max_messages or batch_tokens + tokens > budget):
+            batches.append(batch)
+            batch = []
+            batch_tokens = 0
+        batch.append(i)
+        batch_tokens += tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+def parse_batch_answer(generated_text, count):
+    """
+    Parses the numbered answer of a batch prompt.
+
+    Args:
+        generated_text (str): The generated answer, one '<number>. Location: <location>' line per text.
+        count (int): The number of texts in the batch.
+
+    Returns:
+        list: The location of each text, or None where the answer has no numbered 'Location:' line for it.
+    """
+    locations = [None] * count
+    for line in generated_text.splitlines():
+        match = re.match(r'\s*\[?(\d+)[\].):]\s*(.*)$', line)
+        if not match:
+            continue
+        number = int(match.group(1))
+        answer = match.group(2).strip().strip("'\"").strip()
+        # A numbered line without 'Location:' is not an answer (e.g. the model repeating the text), the text is asked again alone
+        if not re.search(r'Location\s*:', answer):
+            continue
+        if 1 <= number <= count and locations[number - 1] is None:
+            location = parse_location(re.sub(r'Location\s*:\s*', 'Location:', answer))
+            locations[number - 1] = location if location else None
+    return locations
+
+async def generate_text(client, message, question):
     """
     Generates a response from the AI21 API based on the provided message and question.
 
     Args:
+        client (AsyncLLMClient): The open LLM client of the invocation.
         message (str): The message to be analyzed.
         question (str): The question to be asked to the AI21 API.
 
     Returns:
-        str: The extracted location from the AI21 API response.
-    """
-    prompt = message + question
-    # Request headers
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json",
-    }
-    # Request payload
-    request_body = {
-        "prompt": prompt,
-        "maxTokens": 16,  # Specify the maximum number of tokens in the generated completion
-    }
-    
-    # Send the request to the AI21 API
-    response = requests.post(endpoint, data=json.dumps(request_body), headers=headers)
-    
-    # Parse the response JSON
-    response_json = response.json()
-    
-    # Initialize generated_text
-    generated_text = ""
-    
-    # Check if 'completions' key exists in the response
-    if 'completions' in response_json:
-        
-        print("response_json: ", response_json)
-        # Extract the generated text from the response
-        generated_text = response_json['completions'][0]['data']['text']
-        
-        # Clean up the response text
-        generated_text = generated_text.strip()
-    
+        str or None: The extracted location from the AI21 API response, or None if the request failed.
+    """
+    generated_text = await client.complete(message + question, 16)
     print("generated_text: ", generated_text)
-    # Check if the response contains 'Location:null'
-    if 'Location:null' in generated_text:
-        location = 'null'
-    else:
-        # Extract location after 'Location:'
-        location = generated_text.split('Location:')[-1].strip() if generated_text else 'null'
+    if generated_text is None:
+        return None
+    location = parse_location(generated_text)
 
     # Print the cleaned location
     print(f"Location: {location}")
 
     return location
 
-def process_message(message):
+async def generate_batch_text(client, texts):
     """
-    Processes a single message to extract the main location of the event.
+    Asks the AI21 API for the main location of several texts in one numbered prompt.
 
     Args:
-        message (dict): The message containing the event details.
+        client (AsyncLLMClient): The open LLM client of the invocation.
+        texts (list): The texts to be analyzed.
 
     Returns:
-        dict: The message with the added 'location' key.
+        list or None: The location of each text ('null' if it has none), or None where the answer could not be parsed;
+        None instead of the list if the request failed.
     """
-    if message["message"]:
-        print("Processing message:", message["message"])
-        
-        location = None
-        
-        location_question = "Based on the information in the text, please identify the main location where the main event takes place. Choose only one location that accurately represents the main focus of the event. Be sure to find the most specific location (eg city and state and not just a country and so on). (Answer in English Only the location you found. Answer for example: 'ODESA', note that there may not be a central event that can be placed on a map - if you cannot determine a specific location, answer only the exact word- null without any additions to the word"     
-        # Define maximum number of attempts to find a valid location
-        max_attempts = 3
-        attempt_count = 0
-        
-        while attempt_count < max_attempts:
-            location = generate_text(message["message"], location_question)
-            
-            # Check if the location is meaningful, not empty, and does not contain specific words
-            if location and 'null' not in location and location != "":
-                message["location"] = str(location)
-                print("Location found:", location)
-                break  # Exit loop if a valid location is found
+    numbered_texts = "\n".join(f"{number}. {' '.join(text.split())}" for number, text in enumerate(texts, start=1))
+    generated_text = await client.complete(numbered_texts + "\n" + BATCH_LOCATION_QUESTION, BATCH_ANSWER_TOKENS * len(texts))
+    print("generated_text: ", generated_text)
+    if generated_text is None:
+        return None
+    return parse_batch_answer(generated_text, len(texts))
+
+async def extract_location(client, text):
+    """
+    Asks the AI21 API for the main location of a text, retrying until a valid location is found.
+
+    Args:
+        client (AsyncLLMClient): The open LLM client of the invocation.
+        text (str): The text to be analyzed.
+
+    Returns:
+        str or None: The extracted location, 'null' if none was found, or None if the LLM could not be reached.
+    """
+    # Define maximum number of attempts to find a valid location
+    max_attempts = 3
+    for attempt_count in range(max_attempts):
+        location = await generate_text(client, text, LOCATION_QUESTION)
+
+        # The client already retried the request, a failure is not retried as an unusable answer
+        if location is None:
+            return None
+
+        # Check if the location is meaningful, not empty, and does not contain specific words
+        if location and 'null' not in location and location != "":
+            return str(location)
+    return "null"
+
+async def cached_results(texts):
+    """
+    Looks texts up in the location cache. The lookups are blocking S3 reads, run concurrently on the default executor.
+
+    Args:
+        texts (dict): The texts, by cache key.
+
+    Returns:
+        dict: The cached results found, by cache key.
+    """
+    if not CACHE_ENABLED:
+        return {}
+    lookups = await asyncio.gather(*(asyncio.to_thread(location_cache.get, key) for key in texts))
+    return {key: result for key, (result, found) in zip(texts, lookups) if found}
+
+async def cache_results(results, is_negative):
+    """
+    Stores results in the location cache, concurrently on the default executor.
+
+    Args:
+        results (dict): The results, by cache key.
+        is_negative (callable): Tells whether a result is negative, kept for the shorter TTL.
+    """
+    if CACHE_ENABLED:
+        await asyncio.gather(*(asyncio.to_thread(location_cache.put, key, result, is_negative(result))
+                               for key, result in results.items()))
+
+async def locate_texts(texts):
+    """
+    Extracts the location of distinct texts, answering repeated texts from the location cache and asking the
+    LLM for the rest, packed into batch prompts when batching is enabled. Texts whose batch answer cannot be
+    parsed fall back to the single-message path.
+
+    Args:
+        texts (dict): The texts to be analyzed, by cache key.
+
+    Returns:
+        dict: The location of each text ('null' if it has none), by cache key. Texts the LLM could not be
+        reached for are 'null' too, but are not cached.
+    """
+    location_of = await cached_results(texts)
+    failed = set()
+    pending = {key: text for key, text in texts.items() if key not in location_of}
+
+    def record(key, location):
+        if location is None:
+            failed.add(key)
+            location = "null"
+        location_of[key] = location
+
+    async def locate_batch(batch_keys):
+        locations = await generate_batch_text(client, [pending[key] for key in batch_keys])
+        if locations is None:
+            # The endpoint failed after every retry, the texts are not sent again one by one
+            for key in batch_keys:
+                record(key, None)
+            return
+        for key, location in zip(batch_keys, locations):
+            if location is None:
+                print("Batch answer missing, falling back to a single request:", pending[key])
+                location = await extract_location(client, pending[key])
+            elif 'null' in location:
+                location = "null"
+            record(key, location)
+
+    async def locate_single(key):
+        record(key, await extract_location(client, pending[key]))
+
+    if not pending:
+        return location_of
+
+    async with AsyncLLMClient(*llm_credentials()) as client:
+        if BATCH_ENABLED:
+            pending_keys = list(pending)
+            batches = [[pending_keys[i] for i in batch] for batch in plan_batches(list(pending.values()))]
+            print(f"Locating {len(pending)} uncached texts in {len(batches)} batch requests")
+            await asyncio.gather(*(locate_batch(batch_keys) for batch_keys in batches))
+        else:
+            print(f"Locating {len(pending)} uncached texts in single requests")
+            await asyncio.gather(*(locate_single(key) for key in pending))
+
+    if failed:
+        print(f"The LLM could not be reached for {len(failed)} texts, left out of the location cache")
+    await cache_results({key: location_of[key] for key in pending if key not in failed}, lambda location: location == "null")
+    return location_of
+
+def near_duplicate_representatives(texts, message_count):
+    """
+    Groups near-duplicate texts (reposts, wire copies with another byline) so that only one text per group
+    is sent to the LLM, and reports the deduplication ratio of the file.
+
+    Args:
+        texts (dict): The distinct texts of the file, by cache key.
+        message_count (int): The number of messages in the file.
+
+    Returns:
+        dict: The cache key of the representative text of each text's group, by cache key.
+    """
+    if NEAR_DUPLICATES_ENABLED:
+        representative_of = group_near_duplicates(texts, NEAR_DUPLICATES_MAX_DISTANCE, NEAR_DUPLICATES_SHINGLE_SIZE)
+    else:
+        representative_of = {key: key for key in texts}
+    representatives = len(set(representative_of.values()))
+    print(f"Deduplication: {message_count} messages, {len(texts)} distinct texts, {representatives} near-duplicate groups "
+          f"({1 - representatives / message_count if message_count else 0:.1%} of the messages not sent to the LLM)")
+    return representative_of
+
+def locate_messages(messages):
+    """
+    Extracts the location of every message in a single event loop, once per group of near-duplicate texts.
+
+    Args:
+        messages (list): The messages containing the event details.
+
+    Returns:
+        list: The messages with the added 'location' key.
+    """
+    texts = {content_key(message["message"], PROMPT_VERSION): message["message"] for message in messages if message["message"]}
+    representative_of = near_duplicate_representatives(texts, len(messages))
+    location_of = asyncio.run(locate_texts({key: texts[key] for key in set(representative_of.values())}))
+
+    for message in messages:
+        if message["message"]:
+            message["location"] = location_of[representative_of[content_key(message["message"], PROMPT_VERSION)]]
+            if message["location"] != "null":
+                print("Location found:", message["location"])
             else:
-                attempt_count += 1  # Increment attempt count
-                
-        # If no valid location is found after maximum attempts, default to 'null'
-        if attempt_count == max_attempts:
-            message["location"] = "null"
-            print("No valid location found for the message. Message dropped.")
-            
-    return message
+                # If no valid location is found after maximum attempts, default to 'null'
+                print("No valid location found for the message. Message dropped.")
+    return messages
+
+def parse_combined_answer(generated_text):
+    """
+    Parses the structured answer of a combined prompt.
+
+    Args:
+        generated_text (str): The generated answer, 'Location: <location>' followed by 'Events: <events>',
+            on the next line or on the same one.
+
+    Returns:
+        tuple: The location and the event breakdown, each None if the answer has no usable part for it.
+    """
+    # The location stops at the end of its line or at the Events label, whichever comes first
+    match = re.search(r'Location:[ \t]*(.*?)[ \t]*(?=Events:|\n|$)', generated_text)
+    if not match:
+        return None, None
+    location = match.group(1).strip().strip("'\"").strip()
+    if 'null' in location:
+        location = "null"
+    events = re.search(r'Events:\s*(.*)', generated_text[match.end():], re.DOTALL)
+    event_breakdown = events.group(1).strip() if events and events.group(1).strip() else None
+    return location or None, event_breakdown
+
+async def generate_combined_text(client, text, category):
+    """
+    Asks the AI21 API for the main location and the event breakdown of a text in one structured answer.
+
+    Args:
+        client (AsyncLLMClient): The open LLM client of the invocation.
+        text (str): The text to be analyzed.
+        category (str): The category of the events to be identified.
+
+    Returns:
+        tuple or None: The location and the event breakdown, each None if the answer has no usable part for it;
+        None instead of the tuple if the request failed.
+    """
+    generated_text = await client.complete(text + COMBINED_QUESTION.format(category=category), 16 + COMBINED_EVENT_TOKENS)
+    print("generated_text: ", generated_text)
+    if generated_text is None:
+        return None
+    return parse_combined_answer(generated_text)
+
+async def combine_texts(texts, category):
+    """
+    Extracts the location and the event breakdown of distinct texts with one LLM call each, answering repeated
+    texts from the location cache. Texts whose answer has no usable location fall back to the location prompt,
+    and texts whose answer has no usable event breakdown are left to data_extract_events.
+
+    Args:
+        texts (dict): The texts to be analyzed, by cache key.
+        category (str): The category of the events to be identified.
+
+    Returns:
+        dict: The 'location' and 'event_breakdown' (None if left to data_extract_events) of each text, by cache key.
+        Texts the LLM could not be reached for have a 'null' location, and are not cached.
+    """
+    results = await cached_results(texts)
+    pending = {key: text for key, text in texts.items() if key not in results}
+    failed = set()
+    if not pending:
+        return results
+
+    async def combine_single(key):
+        answer = await generate_combined_text(client, pending[key], category)
+        location, event_breakdown = answer if answer is not None else (None, None)
+        if answer is not None and location is None:
+            print("Combined answer has no location, falling back to the location prompt:", pending[key])
+            location = await extract_location(client, pending[key])
+        if location is None:
+            failed.add(key)
+            location = "null"
+        results[key] = {"location": location, "event_breakdown": event_breakdown}
+
+    print(f"Extracting location and events of {len(pending)} uncached texts in combined requests")
+    async with AsyncLLMClient(*llm_credentials()) as client:
+        await asyncio.gather(*(combine_single(key) for key in pending))
+
+    if failed:
+        print(f"The LLM could not be reached for {len(failed)} texts, left out of the location cache")
+    await cache_results({key: results[key] for key in pending if key not in failed}, lambda result: result["location"] == "null")
+    return results
+
+def combined_applies(stages):
+    """
+    Checks whether the combined pass may run in a pipeline order. Its events are only worth extracting for the
+    messages data_classification already kept, so classification must come before this stage.
+
+    Args:
+        stages (list): The stages of the pipeline order of the file.
+
+    Returns:
+        bool: True if data_classification runs before this stage, otherwise False.
+    """
+    return CLASSIFICATION_STAGE in stages and stages.index(CLASSIFICATION_STAGE) < stages.index(LOCATION_STAGE)
+
+def extract_combined(messages, category):
+    """
+    Extracts the location and the event breakdown of every message in a single event loop, once per group of
+    near-duplicate texts.
+
+    Args:
+        messages (list): The messages containing the event details.
+        category (str): The category of the events to be identified.
+
+    Returns:
+        list: The messages with the added 'location' key, and the 'event_breakdown' key where it was extracted.
+    """
+    # Combined results depend on the category through the event question
+    version = f"{PROMPT_VERSION}:combined:{category}"
+    texts = {content_key(message["message"], version): message["message"] for message in messages if message["message"]}
+    representative_of = near_duplicate_representatives(texts, len(messages))
+    results = asyncio.run(combine_texts({key: texts[key] for key in set(representative_of.values())}, category))
+
+    for message in messages:
+        if message["message"]:
+            result = results[representative_of[content_key(message["message"], version)]]
+            message["location"] = result["location"]
+            if result["event_breakdown"] is not None:
+                message["event_breakdown"] = result["event_breakdown"]
+            print("Location found:", message["location"], "event_breakdown:", result["event_breakdown"])
+    return messages
 
 def lambda_handler(event, context):
     """
     AWS Lambda function handler that processes S3 events to extract location information from messages.
 
     Args:
-        event (dict): The event data from the triggering source.
+        event (dict): The event data from the triggering source: the SQS-wrapped S3 notification of a raw file,
+            or the payload of data_classification when classification runs first.
         context (object): The context object providing information about the invocation, function, and execution environment.
 
     Returns:
         dict: A response indicating the status of the operation.
     """
     try:
-        # Extracting S3 bucket name and object key from the SQS message
-        message_body = json.loads(event['Records'][0]['body'])
-        inner_message_body = json.loads(message_body['Message'])
-        bucket_name = inner_message_body['Records'][0]['s3']['bucket']['name']
+        # The raw file of the SQS-wrapped S3 notification, or the messages the previous stage kept
+        stage_input = read_stage_input(event, LOCATION_STAGE)
+        bucket_name = stage_input['bucket_name']
         print("bucket - " + bucket_name)
-        file_name = inner_message_body['Records'][0]['s3']['object']['key']
-        
-        print("Extracting location for " + file_name + " started")
-        
-        # Initialize Boto3 client for S3
-        s3 = boto3.client('s3')
-        
-        # Read JSON data from input S3 bucket
-        if bucket_name == 'raw-data-geoshield':
-            response = s3.get_object(Bucket='raw-data-geoshield', Key=file_name)
-            tags = s3.get_object_tagging(Bucket='raw-data-geoshield', Key=file_name)
-        else:
-            response = s3.get_object(Bucket='custom-raw-data-geoshield', Key=file_name)
-            tags = s3.get_object_tagging(Bucket='custom-raw-data-geoshield', Key=file_name)            
-        
-        # Accessing the 'Category' value from the 'TagSet'
-        for tag in tags['TagSet']:
-            if tag['Key'] == 'Category':
-                category = tag['Value']
-                break
+        file_name = stage_input['file_name']
+        category = stage_input['category']
 
+        # With classification first, a raw file still delivered here goes to data_classification
+        if forward_to_first_stage(stage_input, LOCATION_STAGE):
+            return {
+                "statusCode": 200,
+                "body": json.dumps({"forwarded_to": stage_input['stages'][0]})
+            }
+
+        print("Extracting location for " + file_name + " started")
         print("Category:", category) 
+        messages = stage_input['messages']
         
-        json_data = response['Body'].read().decode('utf-8')
-        messages = json.loads(json_data)
-        
-        max_workers = 10
-        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-            processed_messages = list(filter(lambda x: x is not None, executor.map(process_message, messages)))
+        use_combined = COMBINED_ENABLED and combined_applies(stage_input['stages'])
+        if COMBINED_ENABLED and not use_combined:
+            print("Warning: the combined pass needs the classification_first pipeline order, extracting locations only")
+
+        if use_combined:
+            # One call per message for the location and the events, data_extract_events reuses the events
+            processed_messages = list(filter(lambda x: x is not None, extract_combined(messages, category)))
+        else:
+            processed_messages = list(filter(lambda x: x is not None, locate_messages(messages)))
             
+        print("Location cache: " + json.dumps(location_cache.stats()))
+        print("LLM requests: " + json.dumps(get_rate_controller().stats()))
+
         # Filter out messages with null location
         processed_messages = [msg for msg in processed_messages if msg["location"] != "null"]
         
-        # Invoke another Lambda function to process the results
-        lambda_client = boto3.client('lambda')
+        # Invoke the next stage of the pipeline order (data_classification, or data_extract_events when classification ran first)
         print("output messages: " + str(processed_messages))
-        invoke_response = lambda_client.invoke(
-            FunctionName='data_classification',
-            InvocationType='RequestResponse',
-            Payload=json.dumps({
-                "file_name": file_name,
-                "messages": processed_messages,
-                "category": category,  # Pass the category tag to the next Lambda function
-                "bucket_name": bucket_name
-            })
-        )
+        invoke_next_stage(stage_input, processed_messages)
         
         print("Extracting location for " + file_name + " completed")
         
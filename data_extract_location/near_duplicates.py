@@ -0,0 +1,86 @@
+import hashlib
+import re
+from collections import defaultdict
+
+HASH_BITS = 64
+
+
+def shingles(text, size=3):
+    """
+    Split a text into overlapping word shingles.
+
+    Args:
+        text (str): The text to split.
+        size (int): The number of words in a shingle.
+
+    Returns:
+        list: The shingles, or the single shingle of the whole text when it is shorter than `size` words.
+    """
+    words = re.findall(r'\w+', text.lower())
+    if len(words) <= size:
+        return [' '.join(words)]
+    return [' '.join(words[i:i + size]) for i in range(len(words) - size + 1)]
+
+
+def simhash(text, shingle_size=3):
+    """
+    Compute the 64-bit SimHash of a text over its word shingles.
+
+    Args:
+        text (str): The text to hash.
+        shingle_size (int): The number of words in a shingle.
+
+    Returns:
+        int: The SimHash; near-duplicate texts differ in few bits.
+    """
+    # The bit strings of the shingle hashes, most significant bit first, summed column by column
+    bit_strings = [format(int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'big'),
+                          f'0{HASH_BITS}b') for shingle in shingles(text, shingle_size)]
+    majority = len(bit_strings) / 2
+    return int(''.join('1' if column.count('1') > majority else '0' for column in zip(*bit_strings)), 2)
+
+
+def group_near_duplicates(texts, max_distance=3, shingle_size=3):
+    """
+    Group near-duplicate texts, whose SimHashes differ in at most `max_distance` bits.
+
+    The hashes are split into max_distance + 1 bands; two hashes within the distance agree on at least
+    one whole band, so only texts sharing a band are compared.
+
+    Args:
+        texts (dict): The texts, by key.
+        max_distance (int): The maximum Hamming distance between near-duplicates.
+        shingle_size (int): The number of words in a shingle.
+
+    Returns:
+        dict: The key of the representative of each text's group, by key. A representative is the
+        first text of its group, in the order of `texts`, and maps to itself.
+    """
+    keys = list(texts)
+    hashes = [simhash(texts[key], shingle_size) for key in keys]
+    parent = list(range(len(keys)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    bands = max_distance + 1
+    band_bits = HASH_BITS // bands
+    for band in range(bands):
+        shift = band * band_bits
+        bits = band_bits if band < bands - 1 else HASH_BITS - shift
+        buckets = defaultdict(list)
+        for i, value in enumerate(hashes):
+            buckets[value >> shift & ((1 << bits) - 1)].append(i)
+        for members in buckets.values():
+            for position, i in enumerate(members):
+                for j in members[:position]:
+                    if bin(hashes[i] ^ hashes[j]).count('1') <= max_distance:
+                        root_i, root_j = find(i), find(j)
+                        if root_i != root_j:
+                            # The earlier text stays the representative
+                            parent[max(root_i, root_j)] = min(root_i, root_j)
+
+    return {key: keys[find(i)] for i, key in enumerate(keys)}
@@ -2,17 +2,18 @@ import json
 import boto3
 import googlemaps
 from shapely.geometry import Point
-import geopandas as gpd
 from collections import defaultdict
 import pandas as pd
 import traceback
+from secret_store import get_secret
+from world_index import get_world_index
 
 # Initialize the S3 client
 s3 = boto3.client('s3')
 
 def get_google_maps_key():
     """
-    Retrieve the Google Maps API key from AWS Secrets Manager.
+    Retrieve the Google Maps API key from AWS Secrets Manager, cached across warm invocations.
 
     Returns:
         str: The Google Maps API key.
@@ -22,15 +23,10 @@ def get_google_maps_key():
         Exception: For other errors retrieving the secret.
     """
     secret_name = "google_api_secrets"
-    region_name = "eu-west-1"
-    
-    # Create a Secrets Manager client
-    client = boto3.client('secretsmanager', region_name=region_name)
     
     try:
         # Retrieve the secret
-        response = client.get_secret_value(SecretId=secret_name)
-        secret = json.loads(response['SecretString'])
+        secret = get_secret(secret_name)
         google_maps_key = secret.get('google_key')
         
         if not google_maps_key:
@@ -42,34 +38,38 @@ def get_google_maps_key():
         print(f"Error retrieving Google Maps API key: {e}")
         raise
 
-# Initialize the Google Maps client with the retrieved API key
-google_maps_key = get_google_maps_key()
-gmaps = googlemaps.Client(key=google_maps_key)
+_gmaps = None
+
+def get_gmaps():
+    """
+    Return the Google Maps client, created on first use rather than at import.
+
+    Returns:
+        googlemaps.Client: The Google Maps client.
+    """
+    global _gmaps
+    if _gmaps is None:
+        _gmaps = googlemaps.Client(key=get_google_maps_key())
+    return _gmaps
 
 def get_country_polygon(country_name):
     """
-    Retrieve the polygon for a given country from the GeoPandas dataset.
+    Retrieve a country from the world index by its exact name, ISO code or alias.
 
     Args:
-        country_name (str): The name of the country to retrieve the polygon for.
+        country_name (str): The name of the country to retrieve.
 
     Returns:
-        shapely.geometry.Polygon: The polygon representing the country.
+        int: The index of the country in the world index, whose prepared polygon answers containment tests.
 
     Raises:
         ValueError: If the country is not found in the dataset.
     """
     print(f"Fetching polygon for country: {country_name}")
-    world = gpd.read_file(gpd.datasets.get_path('naturalearth_lowres'))
-    
-    matching_countries = world[world.name.str.contains(country_name.strip(), case=False, na=False)]
-    
-    if matching_countries.empty:
-        raise ValueError(f"Country '{country_name}' not found in the dataset")
-    
-    country_polygon = matching_countries.geometry.values[0]
-    print(f"Found polygon for country: {country_name}")
-    return country_polygon
+    world = get_world_index()
+    country = world.find(country_name)
+    print(f"Found polygon for country: {world.names[country]}")
+    return country
 
 def get_point(location):
     """
@@ -82,7 +82,7 @@ def get_point(location):
         shapely.geometry.Point: The point representing the geocoded location, or None if geocoding fails.
     """
     print(f"Geocoding location: {location}")
-    geocode_result = gmaps.geocode(location)
+    geocode_result = get_gmaps().geocode(location)
     
     if geocode_result:
         loc = geocode_result[0]['geometry']['location']
@@ -98,7 +98,7 @@ def is_physically_contained(country_polygon, sub_location):
     Check if a given location is within a country polygon.
 
     Args:
-        country_polygon (shapely.geometry.Polygon): The polygon representing the country.
+        country_polygon (int): The index of the country in the world index.
         sub_location (str): The location to check.
 
     Returns:
@@ -107,9 +107,14 @@ def is_physically_contained(country_polygon, sub_location):
     print(f"Checking if location '{sub_location}' is within the country")
     sub_location_point = get_point(sub_location)
 
-    if country_polygon and sub_location_point:
-        contained = country_polygon.contains(sub_location_point)
+    if country_polygon is not None and sub_location_point:
+        world = get_world_index()
+        contained = world.contains(country_polygon, sub_location_point)
         print(f"Location '{sub_location}' is within the country: {contained}")
+        if not contained:
+            # The STRtree maps the point to the country it was geocoded in
+            country = world.country_at(sub_location_point)
+            print(f"Location '{sub_location}' is in {world.names[country] if country is not None else 'no country'}")
         return contained
     print(f"Could not determine containment for location '{sub_location}'")
     return False
@@ -121,7 +126,7 @@ def process_json_files(bucket_name, location, country_polygon):
     Args:
         bucket_name (str): The name of the S3 bucket containing the JSON files.
         location (str): The location to filter the events by.
-        country_polygon (shapely.geometry.Polygon): The polygon representing the country.
+        country_polygon (int): The index of the country in the world index.
 
     Returns:
         dict: A dictionary with event categories as keys and counts per date as values.
@@ -0,0 +1,157 @@
+import re
+import unicodedata
+
+import geopandas as gpd
+from shapely.prepared import prep
+from shapely.strtree import STRtree
+
+# Common names of the countries the naturalearth_lowres dataset abbreviates or spells otherwise
+ALIASES = {
+    "usa": "United States of America",
+    "us": "United States of America",
+    "united states": "United States of America",
+    "uk": "United Kingdom",
+    "britain": "United Kingdom",
+    "great britain": "United Kingdom",
+    "england": "United Kingdom",
+    "scotland": "United Kingdom",
+    "wales": "United Kingdom",
+    "northern ireland": "United Kingdom",
+    "russian federation": "Russia",
+    "gaza": "Palestine",
+    "gaza strip": "Palestine",
+    "west bank": "Palestine",
+    "palestinian territories": "Palestine",
+    "holland": "Netherlands",
+    "burma": "Myanmar",
+    "turkiye": "Turkey",
+    "czech republic": "Czechia",
+    "ivory coast": "Côte d'Ivoire",
+    "drc": "Dem. Rep. Congo",
+    "dr congo": "Dem. Rep. Congo",
+    "democratic republic of the congo": "Dem. Rep. Congo",
+    "republic of the congo": "Congo",
+    "central african republic": "Central African Rep.",
+    "dominican republic": "Dominican Rep.",
+    "bosnia and herzegovina": "Bosnia and Herz.",
+    "bosnia": "Bosnia and Herz.",
+    "equatorial guinea": "Eq. Guinea",
+    "south sudan": "S. Sudan",
+    "solomon islands": "Solomon Is.",
+    "falkland islands": "Falkland Is.",
+    "western sahara": "W. Sahara",
+    "swaziland": "eSwatini",
+    "eswatini": "eSwatini",
+    "east timor": "Timor-Leste",
+    "north macedonia": "North Macedonia",
+    "macedonia": "North Macedonia",
+    "republic of korea": "South Korea",
+    "dprk": "North Korea",
+    "uae": "United Arab Emirates",
+    "emirates": "United Arab Emirates",
+}
+
+
+def normalize_name(name):
+    """
+    Normalize a country name for the name index.
+
+    Args:
+        name (str): The name.
+
+    Returns:
+        str: The name lowercased, without accents, punctuation, a leading "the" and repeated spaces.
+    """
+    name = unicodedata.normalize('NFKD', name).encode('ascii', 'ignore').decode('ascii').lower()
+    name = re.sub(r"[^a-z0-9]+", " ", name).strip()
+    return re.sub(r"^the ", "", name)
+
+
+class WorldIndex:
+    """
+    Country polygons of the world dataset, prepared once for repeated containment tests, with an STRtree
+    mapping a point to its country and an index of the exact names, ISO codes and aliases of the countries.
+    """
+
+    def __init__(self, world):
+        """
+        Args:
+            world (geopandas.GeoDataFrame): The countries, with 'name', 'iso_a3' and 'geometry' columns.
+        """
+        self.names = list(world['name'])
+        self.geometries = list(world.geometry.values)
+        self.prepared = [prep(geometry) for geometry in self.geometries]
+        self.tree = STRtree(self.geometries)
+
+        self.name_index = {}
+        for index, (name, iso_a3) in enumerate(zip(world['name'], world['iso_a3'])):
+            self.name_index.setdefault(normalize_name(name), index)
+            if iso_a3 and iso_a3 != '-99':
+                self.name_index.setdefault(normalize_name(iso_a3), index)
+        for alias, name in ALIASES.items():
+            if normalize_name(name) in self.name_index:
+                self.name_index.setdefault(normalize_name(alias), self.name_index[normalize_name(name)])
+
+    def find(self, country_name):
+        """
+        Find a country by its exact name, ISO code or alias. "Niger" is Niger, not Nigeria.
+
+        Args:
+            country_name (str): The name; for "<place>, <country>" the country part is tried when the whole is not a country.
+
+        Returns:
+            int: The index of the country.
+
+        Raises:
+            ValueError: If the country is not found in the dataset.
+        """
+        for candidate in (country_name, country_name.split(',')[-1]):
+            index = self.name_index.get(normalize_name(candidate))
+            if index is not None:
+                return index
+        raise ValueError(f"Country '{country_name}' not found in the dataset")
+
+    def contains(self, country, point):
+        """
+        Check if a country contains a point, with the prepared polygon of the country.
+
+        Args:
+            country (int): The index of the country.
+            point (shapely.geometry.Point): The point.
+
+        Returns:
+            bool: True if the point is within the country.
+        """
+        return self.prepared[country].contains(point)
+
+    def country_at(self, point):
+        """
+        Find the country containing a point.
+
+        Args:
+            point (shapely.geometry.Point): The point.
+
+        Returns:
+            int or None: The index of the country, or None for a point outside every country (at sea).
+        """
+        # The tree narrows the countries to those whose bounding box holds the point (shapely 2 returns indices)
+        for index in self.tree.query(point):
+            if self.prepared[index].contains(point):
+                return int(index)
+        return None
+
+
+_world_index = None
+
+
+def get_world_index():
+    """
+    Return the world index of the container, loaded on first use and kept across warm invocations.
+
+    Returns:
+        WorldIndex: The world index.
+    """
+    global _world_index
+    if _world_index is None:
+        _world_index = WorldIndex(gpd.read_file(gpd.datasets.get_path('naturalearth_lowres')))
+    return _world_index
@@ -0,0 +1,70 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+LAMBDAS = ['data_extract_location', 'data_extract_events', 'data_statistics']
+
+# Imports one Lambda function in a fresh interpreter, the way a cold start does, and prints the import time.
+# With --moto the AWS calls go to moto, and every Secrets Manager call is delayed by a simulated round trip.
+COLD_START = '''
+import json, os, sys, time
+root, name, moto, latency = sys.argv[1], sys.argv[2], sys.argv[3] == "1", float(sys.argv[4])
+sys.path[:0] = [os.path.join(root, 'geoshield_common', 'python'), os.path.join(root, name)]
+os.chdir(os.path.join(root, name))
+if moto:
+    os.environ.update(AWS_DEFAULT_REGION='eu-west-1', AWS_ACCESS_KEY_ID='testing', AWS_SECRET_ACCESS_KEY='testing')
+    import boto3
+    from moto import mock_aws
+    mock_aws().start()
+    secrets = boto3.client('secretsmanager', region_name='eu-west-1')
+    for secret_name, secret in (("ai_api_secrets", {"api_key": "key"}), ("ai_api_endpoint", {"ai_endpoint": "http://localhost"}),
+                                ("google_api_secrets", {"google_key": "key"})):
+        secrets.create_secret(Name=secret_name, SecretString=json.dumps(secret))
+    boto3.setup_default_session()
+    boto3.DEFAULT_SESSION.events.register('before-send.secrets-manager', lambda **kwargs: time.sleep(latency))
+start = time.perf_counter()
+import lambda_function
+print(json.dumps({"import_ms": (time.perf_counter() - start) * 1000}))
+'''
+
+
+def cold_start(root, name, moto, latency):
+    """
+    Measure the import time of a Lambda function in a fresh interpreter.
+
+    Args:
+        root (str): The root of the repository tree to measure.
+        name (str): The folder of the Lambda function.
+        moto (bool): Whether to send the AWS calls to moto.
+        latency (float): The simulated Secrets Manager round trip, in seconds, with moto.
+
+    Returns:
+        float or str: The import time in milliseconds, or the error of the import.
+    """
+    result = subprocess.run([sys.executable, '-c', COLD_START, root, name, '1' if moto else '0', str(latency)],
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        return result.stderr.strip().splitlines()[-1]
+    return json.loads(result.stdout.strip().splitlines()[-1])["import_ms"]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the cold-start import time of the Lambda functions")
+    parser.add_argument('--root', default=ROOT, help="root of the tree to measure, e.g. a worktree of an older commit")
+    parser.add_argument('--lambdas', nargs='+', default=LAMBDAS)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--moto', action='store_true', help="send AWS calls to moto instead of AWS")
+    parser.add_argument('--latency', type=float, default=0.08, help="simulated Secrets Manager round trip with --moto, in seconds")
+    args = parser.parse_args()
+
+    for name in args.lambdas:
+        results = [cold_start(os.path.abspath(args.root), name, args.moto, args.latency) for _ in range(args.runs)]
+        timings = sorted(result for result in results if isinstance(result, float))
+        if not timings:
+            print(f"{name:<24} import failed: {results[0]}")
+            continue
+        print(f"{name:<24} median {timings[len(timings) // 2]:8.1f} ms  min {timings[0]:8.1f} ms  ({len(timings)}/{args.runs} runs)")
@@ -0,0 +1,351 @@
+import configparser
+import json
+import re
+import sqlite3
+import threading
+from datetime import datetime
+
+import boto3
+from boto3.dynamodb.conditions import Attr, Key
+
+# Read the catalog settings from the config.ini of the Lambda function using the layer
+config = configparser.ConfigParser()
+config.read("config.ini")
+
+CATALOG_BACKEND = config.get('CATALOG', 'backend', fallback='dynamodb')
+CATALOG_TABLE = config.get('CATALOG', 'table_name', fallback='geoshield-catalog')
+CATALOG_UUID_INDEX = config.get('CATALOG', 'uuid_index', fallback='uuid-index')
+CATALOG_SQLITE_PATH = config.get('CATALOG', 'sqlite_path', fallback='/tmp/geoshield_catalog.sqlite')
+
+UUID_PATTERN = r'[a-f0-9]{8}-[a-f0-9]{4}-[a-f0-9]{4}-[a-f0-9]{4}-[a-f0-9]{12}'
+
+
+def extract_uuid(key):
+    """
+    Extract a UUID from an object key.
+
+    Args:
+        key (str): The object key.
+
+    Returns:
+        str or None: The extracted UUID if found, otherwise None.
+    """
+    match = re.search(UUID_PATTERN, key)
+    return match.group(0) if match else None
+
+
+def source_of(key):
+    """
+    Derive the source of an object from the first word of its key ('gdelt', 'telegram', 'matching', ...).
+
+    Args:
+        key (str): The object key.
+
+    Returns:
+        str: The source of the object.
+    """
+    return key.split('_')[0]
+
+
+def make_entry(bucket, key, category, date=None, correlated=False):
+    """
+    Build a catalog entry for an object that was just written.
+
+    Args:
+        bucket (str): The bucket of the object.
+        key (str): The key of the object.
+        category (str): The category tag of the object.
+        date (str): The date of the object in '%Y-%m-%d' format; today if omitted.
+        correlated (bool): Whether the object was already consumed by data_corellation.
+
+    Returns:
+        dict: The catalog entry.
+    """
+    now = datetime.now()
+    return {
+        "bucket": bucket,
+        "key": key,
+        "source": source_of(key),
+        "category": category,
+        "date": date or now.strftime('%Y-%m-%d'),
+        "uuid": extract_uuid(key),
+        "correlated": correlated,
+        "updated_at": now.strftime('%Y-%m-%d %H:%M:%S.%f')
+    }
+
+
+class DynamoDBCatalog:
+    """
+    Catalog stored in a DynamoDB table.
+
+    Items are partitioned by "<bucket>#<category>" and sorted by "<date>#<key>", so the files of a
+    category and date range are a single Query. A global secondary index on "uuid" serves the
+    custom flow.
+    """
+
+    def __init__(self, table_name=CATALOG_TABLE, uuid_index=CATALOG_UUID_INDEX):
+        """
+        Args:
+            table_name (str): The name of the DynamoDB table.
+            uuid_index (str): The name of the global secondary index on "uuid".
+        """
+        self.table = boto3.resource('dynamodb').Table(table_name)
+        self.uuid_index = uuid_index
+
+    def put(self, entry):
+        """
+        Insert or replace a catalog entry.
+
+        Args:
+            entry (dict): The entry, as built by make_entry.
+        """
+        self.table.put_item(Item=self._item(entry))
+
+    def find(self, bucket, category, start_date, end_date, correlated=None):
+        """
+        Find the objects of a bucket and category within a date range.
+
+        Args:
+            bucket (str): The bucket of the objects.
+            category (str): The category of the objects.
+            start_date (str): First date, inclusive, in '%Y-%m-%d' format.
+            end_date (str): Last date, inclusive, in '%Y-%m-%d' format.
+            correlated (bool): Only return objects with this correlation flag, if given.
+
+        Returns:
+            list: The matching entries, oldest update first.
+        """
+        condition = Key('pk').eq(f"{bucket}#{category}") & Key('sk').between(f"{start_date}#", f"{end_date}#\uffff")
+        kwargs = {"KeyConditionExpression": condition}
+        if correlated is not None:
+            kwargs["FilterExpression"] = Attr('correlated').eq(correlated)
+        return self._query(**kwargs)
+
+    def find_by_uuid(self, bucket, uuid):
+        """
+        Find the objects of a bucket whose key carries a UUID.
+
+        Args:
+            bucket (str): The bucket of the objects.
+            uuid (str): The UUID in the object keys.
+
+        Returns:
+            list: The matching entries, oldest update first.
+        """
+        return self._query(IndexName=self.uuid_index, KeyConditionExpression=Key('uuid').eq(uuid),
+                           FilterExpression=Attr('bucket').eq(bucket))
+
+    def set_correlated(self, entries):
+        """
+        Set the correlation flag of several entries.
+
+        Args:
+            entries (list): The entries consumed by data_corellation.
+        """
+        # Only the flag is updated, the entries may be older than the items a writer re-recorded since
+        for entry in entries:
+            self.table.update_item(
+                Key={"pk": f"{entry['bucket']}#{entry['category']}", "sk": f"{entry['date']}#{entry['key']}"},
+                UpdateExpression="SET correlated = :correlated",
+                ExpressionAttributeValues={":correlated": True}
+            )
+
+    def _item(self, entry):
+        """
+        Convert a catalog entry to a DynamoDB item with its partition and sort keys.
+
+        Args:
+            entry (dict): The catalog entry.
+
+        Returns:
+            dict: The DynamoDB item.
+        """
+        item = dict(entry, pk=f"{entry['bucket']}#{entry['category']}", sk=f"{entry['date']}#{entry['key']}")
+        if item.get("uuid") is None:
+            # Index keys cannot be null, items without a UUID are simply left out of the index
+            item.pop("uuid", None)
+        return item
+
+    def _query(self, **kwargs):
+        """
+        Run a query through every result page.
+
+        Returns:
+            list: The matching entries, oldest update first.
+        """
+        entries = []
+        while True:
+            response = self.table.query(**kwargs)
+            entries.extend(response.get('Items', []))
+            if 'LastEvaluatedKey' not in response:
+                break
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+        for entry in entries:
+            entry.pop('pk', None)
+            entry.pop('sk', None)
+            entry.setdefault('uuid', None)
+        return sorted(entries, key=lambda entry: entry['updated_at'])
+
+
+class SQLiteCatalog:
+    """
+    Catalog stored in a local SQLite file, a stand-in for DynamoDB in local runs.
+    """
+
+    def __init__(self, path=CATALOG_SQLITE_PATH):
+        """
+        Args:
+            path (str): The path of the SQLite file, created if missing.
+        """
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS catalog (bucket TEXT, key TEXT, source TEXT, category TEXT, date TEXT, "
+                "uuid TEXT, correlated INTEGER, updated_at TEXT, PRIMARY KEY (bucket, key))"
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS catalog_category ON catalog (bucket, category, date)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS catalog_uuid ON catalog (uuid)")
+
+    def put(self, entry):
+        """
+        Insert or replace a catalog entry.
+
+        Args:
+            entry (dict): The entry, as built by make_entry.
+        """
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO catalog VALUES (:bucket, :key, :source, :category, :date, :uuid, :correlated, :updated_at)",
+                entry
+            )
+
+    def find(self, bucket, category, start_date, end_date, correlated=None):
+        """
+        Find the objects of a bucket and category within a date range.
+
+        Args:
+            bucket (str): The bucket of the objects.
+            category (str): The category of the objects.
+            start_date (str): First date, inclusive, in '%Y-%m-%d' format.
+            end_date (str): Last date, inclusive, in '%Y-%m-%d' format.
+            correlated (bool): Only return objects with this correlation flag, if given.
+
+        Returns:
+            list: The matching entries, oldest update first.
+        """
+        query = "SELECT * FROM catalog WHERE bucket = ? AND category = ? AND date BETWEEN ? AND ?"
+        params = [bucket, category, start_date, end_date]
+        if correlated is not None:
+            query += " AND correlated = ?"
+            params.append(int(correlated))
+        return self._select(query + " ORDER BY updated_at", params)
+
+    def find_by_uuid(self, bucket, uuid):
+        """
+        Find the objects of a bucket whose key carries a UUID.
+
+        Args:
+            bucket (str): The bucket of the objects.
+            uuid (str): The UUID in the object keys.
+
+        Returns:
+            list: The matching entries, oldest update first.
+        """
+        return self._select("SELECT * FROM catalog WHERE uuid = ? AND bucket = ? ORDER BY updated_at", [uuid, bucket])
+
+    def set_correlated(self, entries):
+        """
+        Set the correlation flag of several entries in one batch.
+
+        Args:
+            entries (list): The entries consumed by data_corellation.
+        """
+        with self.lock, self.connection:
+            self.connection.executemany("UPDATE catalog SET correlated = 1 WHERE bucket = ? AND key = ?",
+                                        [(entry['bucket'], entry['key']) for entry in entries])
+
+    def _select(self, query, params):
+        """
+        Run a query and convert its rows to entries.
+
+        Returns:
+            list: The matching entries.
+        """
+        with self.lock:
+            rows = self.connection.execute(query, params).fetchall()
+        return [dict(row, correlated=bool(row['correlated'])) for row in rows]
+
+
+_catalog = None
+
+
+def get_catalog():
+    """
+    Return the catalog of the configured backend, created once per container.
+
+    Returns:
+        DynamoDBCatalog or SQLiteCatalog: The catalog.
+    """
+    global _catalog
+    if _catalog is None:
+        if CATALOG_BACKEND == 'dynamodb':
+            _catalog = DynamoDBCatalog()
+        elif CATALOG_BACKEND == 'sqlite':
+            _catalog = SQLiteCatalog()
+        else:
+            raise ValueError(f"Unknown catalog backend: {CATALOG_BACKEND}")
+    return _catalog
+
+
+def record_object(bucket, key, category, correlated=False):
+    """
+    Record an object in the catalog before it is put in S3. Writers call this for every put, ahead of the
+    put, so the invocation the put triggers finds the object in the catalog.
+
+    Args:
+        bucket (str): The bucket of the object.
+        key (str): The key of the object.
+        category (str): The category tag of the object.
+        correlated (bool): Whether the object was already consumed by data_corellation.
+
+    Returns:
+        dict: The recorded catalog entry.
+    """
+    entry = make_entry(bucket, key, category, correlated=correlated)
+    get_catalog().put(entry)
+    return entry
+
+
+def backfill(bucket):
+    """
+    Record every existing object of a bucket in the catalog from its S3 listing and tags.
+
+    Args:
+        bucket (str): The bucket to backfill.
+
+    Returns:
+        int: The number of objects recorded.
+    """
+    s3 = boto3.client('s3')
+    catalog = get_catalog()
+    count = 0
+    for page in s3.get_paginator('list_objects_v2').paginate(Bucket=bucket):
+        for obj in page.get('Contents', []):
+            tags = {tag['Key']: tag['Value'] for tag in s3.get_object_tagging(Bucket=bucket, Key=obj['Key'])['TagSet']}
+            if 'Category' not in tags:
+                continue
+            entry = make_entry(bucket, obj['Key'], tags['Category'], date=obj['LastModified'].strftime('%Y-%m-%d'),
+                               correlated='Corellation_flag' in tags)
+            entry['updated_at'] = obj['LastModified'].strftime('%Y-%m-%d %H:%M:%S.%f')
+            catalog.put(entry)
+            count += 1
+    return count
+
+
+if __name__ == "__main__":
+    import sys
+
+    for bucket_name in sys.argv[1:]:
+        print(json.dumps({"bucket": bucket_name, "recorded": backfill(bucket_name)}))
@@ -0,0 +1,106 @@
+import configparser
+import gzip
+import json
+import os
+import threading
+import uuid
+
+import boto3
+
+# Read the claim-check settings from the config.ini of the Lambda function using the layer
+config = configparser.ConfigParser()
+config.read("config.ini")
+
+# auto - stage message sets larger than max_inline_bytes, always - stage every set, off - always inline
+CLAIM_CHECK_MODE = config.get('CLAIM_CHECK', 'mode', fallback='auto')
+# Below the 256 KB limit of asynchronous invocations, with room for the other payload fields
+CLAIM_CHECK_MAX_INLINE_BYTES = config.getint('CLAIM_CHECK', 'max_inline_bytes', fallback=200000)
+CLAIM_CHECK_BUCKET = config.get('CLAIM_CHECK', 'bucket', fallback='geoshield-staging')
+CLAIM_CHECK_PREFIX = config.get('CLAIM_CHECK', 'prefix', fallback='claim-check/')
+
+STAGED_FORMAT = 'jsonl.gz'
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def _s3():
+    """
+    Return the S3 client, created on first use rather than at import.
+
+    Returns:
+        botocore.client.S3: The S3 client.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = boto3.client('s3')
+        return _client
+
+
+def stage_messages(messages, file_name, mode=CLAIM_CHECK_MODE, max_inline_bytes=CLAIM_CHECK_MAX_INLINE_BYTES):
+    """
+    Return the payload fields that carry messages to the next Lambda function: the messages themselves, or
+    for a large set a manifest of the staging object they were written to once, as gzipped JSON lines.
+
+    Args:
+        messages (list): The messages to pass on.
+        file_name (str): The name of the file the messages come from, used in the staging key.
+        mode (str): 'auto', 'always' or 'off'.
+        max_inline_bytes (int): The largest serialized message set passed inline in 'auto' mode.
+
+    Returns:
+        dict: {"messages": [...]} or {"messages_ref": {"bucket", "key", "format", "count", "bytes", "compressed_bytes"}}.
+    """
+    lines = [json.dumps(message) for message in messages]
+    size = sum(len(line) for line in lines) + 2 * len(lines)
+    if mode == 'off' or (mode == 'auto' and size <= max_inline_bytes):
+        return {"messages": messages}
+
+    body = gzip.compress('\n'.join(lines).encode('utf-8'), compresslevel=6)
+    key = f"{CLAIM_CHECK_PREFIX}{os.path.splitext(os.path.basename(file_name))[0]}/{uuid.uuid4()}.{STAGED_FORMAT}"
+    _s3().put_object(Bucket=CLAIM_CHECK_BUCKET, Key=key, Body=body, ContentType='application/x-ndjson',
+                     ContentEncoding='gzip')
+    print(f"Staged {len(messages)} messages ({size} bytes, {len(body)} compressed) at s3://{CLAIM_CHECK_BUCKET}/{key}")
+    return {"messages_ref": {"bucket": CLAIM_CHECK_BUCKET, "key": key, "format": STAGED_FORMAT,
+                             "count": len(messages), "bytes": size, "compressed_bytes": len(body)}}
+
+
+def iter_messages(payload):
+    """
+    Iterate over the messages of a payload, inline or streamed and decompressed line by line from the staging object.
+
+    Args:
+        payload (dict): The event of the invocation, with "messages" or "messages_ref".
+
+    Yields:
+        dict: The messages, in their original order.
+    """
+    if "messages_ref" not in payload:
+        yield from payload["messages"]
+        return
+
+    manifest = payload["messages_ref"]
+    if manifest.get("format") != STAGED_FORMAT:
+        raise ValueError(f"Unsupported staged format {manifest.get('format')!r}")
+    body = _s3().get_object(Bucket=manifest["bucket"], Key=manifest["key"])['Body']
+    count = 0
+    with gzip.GzipFile(fileobj=body) as stream:
+        for line in stream:
+            count += 1
+            yield json.loads(line)
+    if count != manifest["count"]:
+        raise ValueError(f"Staged object {manifest['key']} holds {count} messages, the manifest {manifest['count']}")
+
+
+def load_messages(payload):
+    """
+    Return the messages of a payload, inline or from the staging object.
+
+    Args:
+        payload (dict): The event of the invocation, with "messages" or "messages_ref".
+
+    Returns:
+        list: The messages.
+    """
+    return list(iter_messages(payload))
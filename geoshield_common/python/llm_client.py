@@ -0,0 +1,281 @@
+import asyncio
+import configparser
+import json
+import random
+import threading
+import time
+from collections import deque
+
+import aiohttp
+
+# Read the client settings from the config.ini of the Lambda function using the layer
+config = configparser.ConfigParser()
+config.read("config.ini")
+
+LLM_CONCURRENCY = config.getint('LLM', 'concurrency', fallback=32)
+LLM_MAX_CONCURRENCY = config.getint('LLM', 'max_concurrency', fallback=64)
+LLM_TIMEOUT_SECONDS = config.getfloat('LLM', 'timeout_seconds', fallback=60)
+# 0 leaves the pacing to the concurrency limit, which halves on 429; set it to the requests-per-second quota of the
+# AI21 account to stay under it. A fixed rate below the quota caps the throughput whatever the concurrency.
+LLM_RATE_PER_SECOND = config.getfloat('LLM', 'rate_per_second', fallback=0)
+LLM_BURST = config.getint('LLM', 'burst', fallback=20)
+LLM_MAX_RETRIES = config.getint('LLM', 'max_retries', fallback=5)
+LLM_BACKOFF_BASE_SECONDS = config.getfloat('LLM', 'backoff_base_seconds', fallback=0.5)
+LLM_BACKOFF_MAX_SECONDS = config.getfloat('LLM', 'backoff_max_seconds', fallback=20)
+
+# Responses worth retrying: throttling and transient server errors
+THROTTLE_STATUSES = {429}
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class RateController:
+    """
+    Token-bucket rate limit and AIMD concurrency limit of the requests to the endpoint.
+
+    The limit on requests in flight grows by about one per window of successful requests and is
+    halved on throttling. One controller lives per container, so the learned limits carry over to
+    the next invocation; its state is guarded by a thread lock, and the waiting is done in the
+    event loop of the invocation. Requests waiting for a slot are parked in a FIFO and woken by
+    release; only a request waiting for a token of the bucket sleeps on a timer.
+    """
+
+    def __init__(self, rate_per_second=LLM_RATE_PER_SECOND, burst=LLM_BURST, concurrency=LLM_CONCURRENCY,
+                 max_concurrency=LLM_MAX_CONCURRENCY, decrease_factor=0.5):
+        """
+        Args:
+            rate_per_second (float): The sustained request rate of the token bucket, 0 for no token bucket.
+            burst (int): The capacity of the token bucket.
+            concurrency (int): The initial limit on requests in flight.
+            max_concurrency (int): The ceiling of the limit on requests in flight.
+            decrease_factor (float): The factor applied to the limit on throttling.
+        """
+        self.rate_per_second = rate_per_second
+        self.burst = burst
+        self.tokens = float(burst)
+        self.refilled_at = time.monotonic()
+        self.limit = float(concurrency)
+        self.max_concurrency = max_concurrency
+        self.decrease_factor = decrease_factor
+        self.in_flight = 0
+        self.waiters = deque()
+        self.lock = threading.Lock()
+        self.started_at = time.monotonic()
+        self.counters = {"requests": 0, "successes": 0, "throttles": 0, "server_errors": 0, "network_errors": 0,
+                         "retries": 0, "failures": 0}
+
+    async def acquire(self):
+        """
+        Wait for a token of the bucket and a free slot under the concurrency limit, then take both.
+        """
+        while True:
+            waiter = None
+            with self.lock:
+                if self.in_flight >= int(self.limit):
+                    waiter = asyncio.get_running_loop().create_future()
+                    self.waiters.append(waiter)
+                else:
+                    now = time.monotonic()
+                    if self.rate_per_second > 0:
+                        self.tokens = min(self.burst, self.tokens + (now - self.refilled_at) * self.rate_per_second)
+                    else:
+                        self.tokens = float(max(self.burst, 1))
+                    self.refilled_at = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        self.in_flight += 1
+                        self.counters["requests"] += 1
+                        return
+                    wait = (1 - self.tokens) / self.rate_per_second
+
+            if waiter is None:
+                await asyncio.sleep(wait)
+                continue
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                with self.lock:
+                    if waiter in self.waiters:
+                        self.waiters.remove(waiter)
+                    else:
+                        # Woken and cancelled at once, the slot goes to the next waiter
+                        self._wake_waiters()
+                raise
+
+    def _wake_waiters(self):
+        """
+        Wake the waiters in arrival order, one per free slot under the concurrency limit. Must be called with the lock held.
+        """
+        for _ in range(int(self.limit) - self.in_flight):
+            while self.waiters and self.waiters[0].done():
+                self.waiters.popleft()
+            if not self.waiters:
+                return
+            self.waiters.popleft().set_result(None)
+
+    def release(self, outcome):
+        """
+        Free a slot and adapt the concurrency limit to the outcome of the request.
+
+        Args:
+            outcome (str): 'success', 'throttle', 'server_error' or 'network_error'.
+        """
+        with self.lock:
+            self.in_flight -= 1
+            if outcome == 'success':
+                self.counters["successes"] += 1
+                # Additive increase: about one more slot per window of successful requests
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            else:
+                self.counters[outcome + "s"] += 1
+                if outcome == 'throttle':
+                    # Multiplicative decrease
+                    self.limit = max(1.0, self.limit * self.decrease_factor)
+            self._wake_waiters()
+
+    def count(self, counter):
+        """
+        Increment a counter.
+
+        Args:
+            counter (str): The name of the counter.
+        """
+        with self.lock:
+            self.counters[counter] += 1
+
+    def stats(self):
+        """
+        Return the counters, the current concurrency limit and the effective request rate.
+
+        Returns:
+            dict: The counters with 'concurrency_limit' and 'successes_per_second' since the container started.
+        """
+        with self.lock:
+            counters = dict(self.counters)
+            counters["concurrency_limit"] = round(self.limit, 2)
+        counters["successes_per_second"] = round(counters["successes"] / max(time.monotonic() - self.started_at, 1e-9), 2)
+        return counters
+
+
+def backoff_seconds(attempt, base_seconds=LLM_BACKOFF_BASE_SECONDS, max_seconds=LLM_BACKOFF_MAX_SECONDS):
+    """
+    Exponential backoff with full jitter.
+
+    Args:
+        attempt (int): The number of the failed attempt, from 0.
+        base_seconds (float): The backoff of the first attempt.
+        max_seconds (float): The ceiling of the backoff.
+
+    Returns:
+        float: A random delay between 0 and the capped exponential backoff.
+    """
+    return random.uniform(0, min(max_seconds, base_seconds * 2 ** attempt))
+
+
+_rate_controller = None
+
+
+def get_rate_controller():
+    """
+    Return the rate controller of the container, created on first use.
+
+    Returns:
+        RateController: The rate controller.
+    """
+    global _rate_controller
+    if _rate_controller is None:
+        _rate_controller = RateController()
+    return _rate_controller
+
+
+class AsyncLLMClient:
+    """
+    Asynchronous client of the AI21 completion endpoint over a keep-alive connection pool.
+
+    Open it with "async with" inside the event loop of an invocation. Requests go through the rate
+    controller of the container; throttled (429), 5xx and failed requests are retried with exponential
+    backoff and jitter instead of immediately.
+    """
+
+    def __init__(self, endpoint, api_key, rate_controller=None, timeout_seconds=LLM_TIMEOUT_SECONDS, max_retries=LLM_MAX_RETRIES):
+        """
+        Args:
+            endpoint (str): The URL of the completion endpoint.
+            api_key (str): The API key sent as a bearer token.
+            rate_controller (RateController): The rate controller, the one of the container if omitted.
+            timeout_seconds (float): The total timeout of a request.
+            max_retries (int): The number of retries of a throttled or failed request.
+        """
+        self.endpoint = endpoint
+        self.headers = {
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json",
+        }
+        self.rate_controller = rate_controller or get_rate_controller()
+        self.timeout_seconds = timeout_seconds
+        self.max_retries = max_retries
+        self.session = None
+
+    async def __aenter__(self):
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.rate_controller.max_concurrency),
+            timeout=aiohttp.ClientTimeout(total=self.timeout_seconds),
+            headers=self.headers
+        )
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+        self.session = None
+
+    async def complete(self, prompt, max_tokens):
+        """
+        Send a prompt and return the generated completion.
+
+        Args:
+            prompt (str): The prompt to be completed.
+            max_tokens (int): The maximum number of tokens in the generated completion.
+
+        Returns:
+            str or None: The generated text, stripped, an empty string if the response has no completion,
+            or None if every attempt failed; a failure is not an answer and must not be cached as one.
+        """
+        request_body = json.dumps({
+            "prompt": prompt,
+            "maxTokens": max_tokens,
+        })
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self.rate_controller.count("retries")
+            retry_after = None
+            await self.rate_controller.acquire()
+            outcome = 'network_error'
+            try:
+                async with self.session.post(self.endpoint, data=request_body) as response:
+                    if response.status in RETRY_STATUSES:
+                        outcome = 'throttle' if response.status in THROTTLE_STATUSES else 'server_error'
+                        retry_after = response.headers.get('Retry-After')
+                    else:
+                        response_json = await response.json(content_type=None)
+                        outcome = 'success'
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                print(f"LLM request failed: {e!r}")
+            finally:
+                self.rate_controller.release(outcome)
+
+            if outcome == 'success':
+                # Extract the generated text from the response, if any
+                if isinstance(response_json, dict) and 'completions' in response_json:
+                    return response_json['completions'][0]['data']['text'].strip()
+                return ""
+
+            if attempt == self.max_retries:
+                break
+            delay = backoff_seconds(attempt)
+            if retry_after is not None and retry_after.isdigit():
+                delay = max(delay, float(retry_after))
+            print(f"LLM request {outcome}, retrying in {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+        print(f"LLM request failed after {self.max_retries + 1} attempts")
+        self.rate_controller.count("failures")
+        return None
@@ -0,0 +1,137 @@
+import configparser
+import json
+import threading
+
+import boto3
+
+from claim_check import load_messages, stage_messages
+
+# Read the pipeline settings from the config.ini of the Lambda function using the layer
+config = configparser.ConfigParser()
+config.read("config.ini")
+
+LOCATION_STAGE = 'data_extract_location'
+CLASSIFICATION_STAGE = 'data_classification'
+EVENTS_STAGE = 'data_extract_events'
+
+# The stages a raw file goes through. location_first locates every message and classifies the located ones;
+# classification_first sends only the on-category messages to the LLM stages.
+STAGE_ORDERS = {
+    'location_first': [LOCATION_STAGE, CLASSIFICATION_STAGE, EVENTS_STAGE],
+    'classification_first': [CLASSIFICATION_STAGE, LOCATION_STAGE, EVENTS_STAGE],
+}
+PIPELINE_ORDER = config.get('PIPELINE', 'order', fallback='location_first')
+
+# Invocations awaited by the calling stage, as data_classification was by data_extract_location; others are asynchronous
+SYNCHRONOUS_HOPS = {(LOCATION_STAGE, CLASSIFICATION_STAGE)}
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def _lambda():
+    """
+    Return the Lambda client, created on first use rather than at import.
+
+    Returns:
+        botocore.client.Lambda: The Lambda client.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = boto3.client('lambda')
+        return _client
+
+
+def read_raw_file(event):
+    """
+    Read the raw file of an SQS-wrapped S3 notification, with the category it is tagged with.
+
+    Args:
+        event (dict): The SQS event of the first stage.
+
+    Returns:
+        dict: The stage input: 'file_name', 'category', 'bucket_name', 'messages' and the 'stages' of the configured order.
+    """
+    message_body = json.loads(event['Records'][0]['body'])
+    inner_message_body = json.loads(message_body['Message'])
+    bucket_name = inner_message_body['Records'][0]['s3']['bucket']['name']
+    file_name = inner_message_body['Records'][0]['s3']['object']['key']
+    source_bucket = 'raw-data-geoshield' if bucket_name == 'raw-data-geoshield' else 'custom-raw-data-geoshield'
+
+    s3 = boto3.client('s3')
+    response = s3.get_object(Bucket=source_bucket, Key=file_name)
+    tags = s3.get_object_tagging(Bucket=source_bucket, Key=file_name)
+    category = next((tag['Value'] for tag in tags['TagSet'] if tag['Key'] == 'Category'), None)
+
+    return {"file_name": file_name, "category": category, "bucket_name": bucket_name,
+            "messages": json.loads(response['Body'].read().decode('utf-8')), "stages": STAGE_ORDERS[PIPELINE_ORDER]}
+
+
+def read_stage_input(event, current):
+    """
+    Read the input of a stage, from the S3 notification of a raw file or from the payload of the previous stage.
+
+    Args:
+        event (dict): The SQS event of the first stage, or the payload {"file_name", "category", "bucket_name",
+            "messages" or "messages_ref", "stages"} of the previous one.
+        current (str): The name of the current stage.
+
+    Returns:
+        dict: The stage input: 'file_name', 'category', 'bucket_name', 'messages' and 'stages', the stages left
+        with the current one first. Payloads without 'stages' follow the location_first order.
+    """
+    if 'Records' in event:
+        return read_raw_file(event)
+    location_first = STAGE_ORDERS['location_first']
+    return {"file_name": event['file_name'], "category": event['category'], "bucket_name": event['bucket_name'],
+            "messages": load_messages(event),
+            "stages": event.get('stages', location_first[location_first.index(current):])}
+
+
+def invoke_next_stage(stage_input, messages):
+    """
+    Invoke the stage after the current one with its output messages, inline or by claim check.
+
+    Args:
+        stage_input (dict): The input of the current stage, from read_stage_input.
+        messages (list): The messages the current stage kept.
+
+    Returns:
+        str or None: The name of the invoked stage, None if the current stage is the last one.
+    """
+    current, remaining = stage_input['stages'][0], stage_input['stages'][1:]
+    if not remaining:
+        return None
+    _lambda().invoke(
+        FunctionName=remaining[0],
+        InvocationType='RequestResponse' if (current, remaining[0]) in SYNCHRONOUS_HOPS else 'Event',
+        Payload=json.dumps({
+            "file_name": stage_input['file_name'],
+            "category": stage_input['category'],
+            "bucket_name": stage_input['bucket_name'],
+            # The messages inline, or a reference to the staging object a large set is written to
+            **stage_messages(messages, stage_input['file_name']),
+            "stages": remaining
+        })
+    )
+    return remaining[0]
+
+
+def forward_to_first_stage(stage_input, current):
+    """
+    Hand a raw file read by a stage that is not the first of the configured order over to the first one,
+    so that the order can change without moving the SQS trigger.
+
+    Args:
+        stage_input (dict): The input read by the current stage.
+        current (str): The name of the current stage.
+
+    Returns:
+        bool: True if the file was handed over and the current stage has nothing to do with it now.
+    """
+    if stage_input['stages'][0] == current:
+        return False
+    print(f"Pipeline order {PIPELINE_ORDER}: handing {stage_input['file_name']} over to {stage_input['stages'][0]}")
+    invoke_next_stage(dict(stage_input, stages=[current] + stage_input['stages']), stage_input['messages'])
+    return True
@@ -0,0 +1,319 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import boto3
+from botocore.exceptions import BotoCoreError, ClientError
+
+
+def normalize_text(text):
+    """
+    Normalize a text before hashing, so that forwards and republished copies differing only in case and
+    whitespace share a cache entry.
+
+    Args:
+        text (str): The text to normalize.
+
+    Returns:
+        str: The lowercased text with runs of whitespace collapsed.
+    """
+    return re.sub(r'\s+', ' ', text).strip().lower()
+
+
+def content_key(text, version):
+    """
+    Build the cache key of a text for a given prompt or model version.
+
+    Args:
+        text (str): The text the cached result was computed from.
+        version (str): The version of the prompt or model that computed it.
+
+    Returns:
+        str: The hex SHA-256 of the version and the normalized text.
+    """
+    return hashlib.sha256(f"{version}\n{normalize_text(text)}".encode('utf-8')).hexdigest()
+
+
+class S3Store:
+    """
+    Shared store keeping one small JSON object per key in an S3 bucket.
+
+    The cache must never fail the invocation: S3 errors (throttling, AccessDenied, which S3 returns for a
+    missing key without s3:ListBucket, network errors) are logged, a failed read is a miss and a failed
+    write or delete does nothing.
+    """
+
+    def __init__(self, bucket, prefix):
+        """
+        Args:
+            bucket (str): The name of the S3 bucket.
+            prefix (str): The key prefix of the cache objects.
+        """
+        self.client = None
+        self.client_lock = threading.Lock()
+        self.bucket = bucket
+        self.prefix = prefix
+
+    @property
+    def s3(self):
+        """
+        The S3 client, created on first use rather than at import.
+        """
+        with self.client_lock:
+            if self.client is None:
+                self.client = boto3.client('s3')
+            return self.client
+
+    def get(self, key):
+        """
+        Read an entry.
+
+        Args:
+            key (str): The cache key.
+
+        Returns:
+            dict or None: The stored entry with 'value' and 'expires_at', or None if missing or unreadable.
+        """
+        try:
+            response = self.s3.get_object(Bucket=self.bucket, Key=self.prefix + key)
+            return json.loads(response['Body'].read().decode('utf-8'))
+        except (ClientError, BotoCoreError, ValueError) as e:
+            if not (isinstance(e, ClientError) and e.response.get('Error', {}).get('Code') == 'NoSuchKey'):
+                print(f"Cache read of {key} failed, treated as a miss: {e}")
+            return None
+
+    def put(self, key, entry):
+        """
+        Write an entry.
+
+        Args:
+            key (str): The cache key.
+            entry (dict): The entry with 'value' and 'expires_at'.
+        """
+        try:
+            self.s3.put_object(Bucket=self.bucket, Key=self.prefix + key, Body=json.dumps(entry))
+        except (ClientError, BotoCoreError) as e:
+            print(f"Cache write of {key} failed, not cached: {e}")
+
+    def delete(self, key):
+        """
+        Delete an entry.
+
+        Args:
+            key (str): The cache key.
+        """
+        try:
+            self.s3.delete_object(Bucket=self.bucket, Key=self.prefix + key)
+        except (ClientError, BotoCoreError) as e:
+            print(f"Cache delete of {key} failed: {e}")
+
+
+class FileStore:
+    """
+    Shared store keeping one JSON file per key in a local directory, a stand-in for S3 in local runs.
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): The directory of the cache files, created if missing.
+        """
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def get(self, key):
+        """
+        Read an entry.
+
+        Args:
+            key (str): The cache key.
+
+        Returns:
+            dict or None: The stored entry with 'value' and 'expires_at', or None if missing.
+        """
+        try:
+            with open(os.path.join(self.path, key)) as file:
+                return json.load(file)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def put(self, key, entry):
+        """
+        Write an entry atomically.
+
+        Args:
+            key (str): The cache key.
+            entry (dict): The entry with 'value' and 'expires_at'.
+        """
+        temporary_path = os.path.join(self.path, f".{key}.{threading.get_ident()}")
+        with open(temporary_path, 'w') as file:
+            json.dump(entry, file)
+        os.replace(temporary_path, os.path.join(self.path, key))
+
+    def delete(self, key):
+        """
+        Delete an entry.
+
+        Args:
+            key (str): The cache key.
+        """
+        try:
+            os.remove(os.path.join(self.path, key))
+        except FileNotFoundError:
+            pass
+
+
+def make_store(kind, bucket=None, prefix=None, path=None):
+    """
+    Create the shared store configured for a cache.
+
+    Args:
+        kind (str): 's3', 'file' or 'none'.
+        bucket (str): The S3 bucket of the 's3' store.
+        prefix (str): The key prefix of the 's3' store.
+        path (str): The directory of the 'file' store.
+
+    Returns:
+        S3Store or FileStore or None: The store, or None for an in-process cache only.
+    """
+    if kind == 's3':
+        return S3Store(bucket, prefix)
+    if kind == 'file':
+        return FileStore(path)
+    if kind == 'none':
+        return None
+    raise ValueError(f"Unknown cache store: {kind}")
+
+
+class TwoTierCache:
+    """
+    In-process LRU in front of an optional shared store, with separate TTLs for positive and negative results.
+    """
+
+    def __init__(self, store=None, max_entries=10000, ttl_seconds=30 * 24 * 3600, negative_ttl_seconds=24 * 3600):
+        """
+        Args:
+            store (S3Store or FileStore): The shared store, or None for an in-process cache only.
+            max_entries (int): The capacity of the in-process LRU.
+            ttl_seconds (float): How long a positive result stays valid.
+            negative_ttl_seconds (float): How long a negative result stays valid.
+        """
+        self.store = store
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.counters = {"memory_hits": 0, "store_hits": 0, "misses": 0, "expired": 0,
+                         "negative_puts": 0, "puts": 0}
+
+    def get(self, key):
+        """
+        Look a key up in both tiers.
+
+        Args:
+            key (str): The cache key.
+
+        Returns:
+            tuple: The value and whether a valid entry was found.
+        """
+        with self.lock:
+            value, found = self._memory_get(key)
+            if found:
+                self.counters["memory_hits"] += 1
+                return value, True
+        value, found = self._store_get(key)
+        if not found:
+            with self.lock:
+                self.counters["misses"] += 1
+        return value, found
+
+    def put(self, key, value, negative=False):
+        """
+        Cache a value in both tiers.
+
+        Args:
+            key (str): The cache key.
+            value: The value to cache.
+            negative (bool): Whether the value is a negative result, kept for the shorter TTL.
+        """
+        self._put(key, value, negative)
+
+    def stats(self):
+        """
+        Return the hit and miss counters.
+
+        Returns:
+            dict: The counters and the hit rate over all lookups.
+        """
+        with self.lock:
+            counters = dict(self.counters)
+        hits = counters["memory_hits"] + counters["store_hits"]
+        lookups = hits + counters["misses"]
+        counters["hit_rate"] = hits / lookups if lookups else 0.0
+        return counters
+
+    def _memory_get(self, key):
+        """
+        Look a key up in the in-process LRU. Must be called with the lock held.
+
+        Returns:
+            tuple: The value and whether a valid entry was found.
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            return None, False
+        if entry["expires_at"] <= time.time():
+            del self.entries[key]
+            self.counters["expired"] += 1
+            return None, False
+        self.entries.move_to_end(key)
+        return entry["value"], True
+
+    def _memory_put(self, key, entry):
+        """
+        Insert an entry in the in-process LRU, evicting the least recently used one when full.
+        Must be called with the lock held.
+        """
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def _store_get(self, key):
+        """
+        Look a key up in the shared store and promote a valid entry to the in-process LRU.
+
+        Returns:
+            tuple: The value and whether a valid entry was found.
+        """
+        if self.store is None:
+            return None, False
+        entry = self.store.get(key)
+        if entry is None:
+            return None, False
+        if entry["expires_at"] <= time.time():
+            self.store.delete(key)
+            with self.lock:
+                self.counters["expired"] += 1
+            return None, False
+        with self.lock:
+            self.counters["store_hits"] += 1
+            self._memory_put(key, entry)
+        return entry["value"], True
+
+    def _put(self, key, value, negative):
+        """
+        Cache a computed value in both tiers with the TTL of its kind.
+        """
+        ttl_seconds = self.negative_ttl_seconds if negative else self.ttl_seconds
+        entry = {"value": value, "expires_at": time.time() + ttl_seconds}
+        with self.lock:
+            self.counters["negative_puts" if negative else "puts"] += 1
+            self._memory_put(key, entry)
+        if self.store is not None:
+            self.store.put(key, entry)
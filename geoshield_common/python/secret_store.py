@@ -0,0 +1,65 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+
+SECRETS_REGION = 'eu-west-1'
+SECRETS_TTL_SECONDS = 15 * 60
+
+_client = None
+_cache = {}
+_lock = threading.Lock()
+
+
+def _secrets_client():
+    """
+    Return the Secrets Manager client, created on first use rather than at import.
+
+    Returns:
+        botocore.client.SecretsManager: The Secrets Manager client.
+    """
+    global _client
+    with _lock:
+        if _client is None:
+            _client = boto3.client('secretsmanager', region_name=SECRETS_REGION)
+        return _client
+
+
+def get_secret(secret_name, ttl_seconds=SECRETS_TTL_SECONDS):
+    """
+    Return a JSON secret, fetched on first use and cached across warm invocations for a TTL.
+
+    Args:
+        secret_name (str): The name of the secret in AWS Secrets Manager.
+        ttl_seconds (float): How long a fetched secret is reused before it is fetched again.
+
+    Returns:
+        dict: The parsed SecretString of the secret.
+    """
+    with _lock:
+        cached = _cache.get(secret_name)
+    if cached is not None and cached[1] > time.monotonic():
+        return cached[0]
+
+    response = _secrets_client().get_secret_value(SecretId=secret_name)
+    secret = json.loads(response['SecretString'])
+    with _lock:
+        _cache[secret_name] = (secret, time.monotonic() + ttl_seconds)
+    return secret
+
+
+def get_secrets(*secret_names, ttl_seconds=SECRETS_TTL_SECONDS):
+    """
+    Return several JSON secrets, fetching the missing or expired ones concurrently.
+
+    Args:
+        *secret_names (str): The names of the secrets in AWS Secrets Manager.
+        ttl_seconds (float): How long a fetched secret is reused before it is fetched again.
+
+    Returns:
+        list: The parsed SecretString of each secret, in the order of secret_names.
+    """
+    with ThreadPoolExecutor(max_workers=len(secret_names)) as executor:
+        return list(executor.map(lambda secret_name: get_secret(secret_name, ttl_seconds), secret_names))
@@ -2,6 +2,7 @@ import json
 import boto3
 import re
 from datetime import datetime
+from catalog import get_catalog
 
 def load_json_from_s3(bucket_name, file_key):
     """
@@ -66,7 +67,8 @@ def lambda_handler(event, context):
             classified_bucket = "custom-classified-data-geoshield"
             matching_bucket = "custom-matching-events-geoshield"
 
-        s3 = boto3.client('s3')
+        # Files are looked up in the catalog instead of listing and tagging whole buckets
+        catalog = get_catalog()
 
         classified_files = []
         matching_files = []
@@ -74,19 +76,8 @@ def lambda_handler(event, context):
         if uuid_param:
             # Fetch files with the specified UUID from S3
             print("Fetching files with UUID:", uuid_param)
-            response_classified = s3.list_objects_v2(Bucket=classified_bucket, FetchOwner=True)
-            if 'Contents' in response_classified:
-                for file in response_classified['Contents']:
-                    file_uuid = extract_uuid(file['Key'])
-                    if file_uuid == uuid_param:
-                        classified_files.append(file['Key'])
-
-            response_matching = s3.list_objects_v2(Bucket=matching_bucket, FetchOwner=True)
-            if 'Contents' in response_matching:
-                for file in response_matching['Contents']:
-                    file_uuid = extract_uuid(file['Key'])
-                    if file_uuid == uuid_param:
-                        matching_files.append(file['Key'])
+            classified_files = [entry['key'] for entry in catalog.find_by_uuid(classified_bucket, uuid_param)]
+            matching_files = [entry['key'] for entry in catalog.find_by_uuid(matching_bucket, uuid_param)]
         else:
             # Fetch files based on category and date range
             category = query_params.get('category')
@@ -108,29 +99,8 @@ def lambda_handler(event, context):
                     }
                 }
 
-            response_classified = s3.list_objects_v2(Bucket=classified_bucket, FetchOwner=True)
-            if 'Contents' in response_classified:
-                for file in response_classified['Contents']:
-                    last_modified = file['LastModified']
-                    last_modified_date = last_modified.strftime('%Y-%m-%d')
-                    print(f"Checking file {file['Key']} with last modified date {last_modified_date}")
-                    if start_date <= last_modified_date <= end_date:
-                        tags_response = s3.get_object_tagging(Bucket=classified_bucket, Key=file['Key'])
-                        object_tags = tags_response.get('TagSet', [])
-                        if any(tag['Key'] == 'Category' and tag['Value'] == category for tag in object_tags):
-                            classified_files.append(file['Key'])
-
-            response_matching = s3.list_objects_v2(Bucket=matching_bucket, FetchOwner=True)
-            if 'Contents' in response_matching:
-                for file in response_matching['Contents']:
-                    last_modified = file['LastModified']
-                    last_modified_date = last_modified.strftime('%Y-%m-%d')
-                    print(f"Checking file {file['Key']} with last modified date {last_modified_date}")
-                    if start_date <= last_modified_date <= end_date:
-                        tags_response = s3.get_object_tagging(Bucket=matching_bucket, Key=file['Key'])
-                        object_tags = tags_response.get('TagSet', [])
-                        if any(tag['Key'] == 'Category' and tag['Value'] == category for tag in object_tags):
-                            matching_files.append(file['Key'])
+            classified_files = [entry['key'] for entry in catalog.find(classified_bucket, category, start_date, end_date)]
+            matching_files = [entry['key'] for entry in catalog.find(matching_bucket, category, start_date, end_date)]
 
         print("Classified Files:", classified_files)
         print("Matching Files:", matching_files)
@@ -0,0 +1,30 @@
+import importlib.util
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The modules of the shared Lambda layer, importable as they are in the Lambda runtime
+sys.path.insert(0, os.path.join(ROOT, 'geoshield_common', 'python'))
+
+
+@pytest.fixture
+def load_lambda(monkeypatch):
+    """
+    Import the lambda_function module of a Lambda folder the way the runtime does: from the folder, reading
+    its config.ini and with its helper modules importable.
+
+    Returns:
+        callable: Takes the name of the folder and returns the module.
+    """
+    def load(folder):
+        path = os.path.join(ROOT, folder)
+        monkeypatch.chdir(path)
+        monkeypatch.syspath_prepend(path)
+        spec = importlib.util.spec_from_file_location(f"{folder}.lambda_function", os.path.join(path, 'lambda_function.py'))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+    return load
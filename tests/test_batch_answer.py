@@ -0,0 +1,21 @@
+import pytest
+
+
+@pytest.fixture
+def parse_batch_answer(load_lambda):
+    return load_lambda('data_extract_location').parse_batch_answer
+
+
+def test_numbered_locations(parse_batch_answer):
+    assert parse_batch_answer("1. Location: Kharkiv, Ukraine\n2) Location:null\n[3] Location : Haifa, Israel", 3) == [
+        "Kharkiv, Ukraine", "null", "Haifa, Israel"]
+
+
+def test_lines_without_location_fall_back(parse_batch_answer):
+    # Numbered lines that echo the texts are not answers, their texts are asked again alone
+    answer = "1. Shelling hit the outskirts of the city overnight.\n2. Location: Odesa, Ukraine\n3. Location:"
+    assert parse_batch_answer(answer, 3) == [None, "Odesa, Ukraine", None]
+
+
+def test_first_answer_of_a_number_wins(parse_batch_answer):
+    assert parse_batch_answer("1. The text reports a strike.\n1. Location: Gaza\n1. Location: Rafah", 1) == ["Gaza"]
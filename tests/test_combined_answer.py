@@ -0,0 +1,28 @@
+import pytest
+
+
+@pytest.fixture
+def parse_combined_answer(load_lambda):
+    return load_lambda('data_extract_location').parse_combined_answer
+
+
+def test_answer_on_two_lines(parse_combined_answer):
+    assert parse_combined_answer("Location: Kharkiv, Ukraine\nEvents: Missile strike on a residential building.") == (
+        "Kharkiv, Ukraine", "Missile strike on a residential building.")
+
+
+def test_answer_on_one_line(parse_combined_answer):
+    assert parse_combined_answer("Location: Kharkiv, Ukraine Events: Missile strike on a residential building.") == (
+        "Kharkiv, Ukraine", "Missile strike on a residential building.")
+
+
+def test_null_and_missing_parts(parse_combined_answer):
+    assert parse_combined_answer("Location: null Events: null") == ("null", "null")
+    assert parse_combined_answer("Location: Odesa") == ("Odesa", None)
+    assert parse_combined_answer("Events: Flooding in the valley.") == (None, None)
+
+
+def test_combined_pass_needs_classification_first(load_lambda):
+    module = load_lambda('data_extract_location')
+    assert module.combined_applies(['data_classification', 'data_extract_location', 'data_extract_events'])
+    assert not module.combined_applies(['data_extract_location', 'data_classification', 'data_extract_events'])
@@ -0,0 +1,163 @@
+import copy
+import glob
+import json
+import os
+from collections import Counter
+from datetime import datetime
+
+import Levenshtein
+import pytest
+
+from conftest import ROOT
+
+# Messages of the classified-data-geoshield snapshot correlated by the tests
+SLICE_SIZE = 300
+
+
+def snapshot_messages(limit=SLICE_SIZE):
+    """
+    Load the first classified messages of the snapshot that can be correlated.
+
+    Returns:
+        list: Up to `limit` message dictionaries.
+    """
+    messages = []
+    for file_path in sorted(glob.glob(os.path.join(ROOT, 'classified-data-geoshield', '*.json'))):
+        with open(file_path) as file:
+            try:
+                data = json.load(file)
+            except ValueError:
+                continue
+        # Older GDELT snapshots predate domain_classification and cannot be correlated
+        messages.extend(message for message in data if message.get("message") and message.get("location")
+                        and ("channel_id" in message or "domain_classification" in message))
+        if len(messages) >= limit:
+            break
+    return messages[:limit]
+
+
+def jaccard(text1, text2):
+    """
+    Returns:
+        float: simphile's Jaccard similarity, over the multisets of whitespace-separated tokens.
+    """
+    tokens1, tokens2 = text1.split(), text2.split()
+    intersection = sum((Counter(tokens1) & Counter(tokens2)).values())
+    return intersection / (len(tokens1) + len(tokens2) - intersection)
+
+
+def levenshtein(text1, text2):
+    """
+    Returns:
+        float: The Levenshtein similarity from the full edit distance.
+    """
+    return 1 - Levenshtein.distance(text1, text2) / max(len(text1), len(text2))
+
+
+def similar(text1, text2):
+    """
+    Returns:
+        bool: True if both similarities fall within the matching window.
+    """
+    return 0.3 <= jaccard(text1, text2) <= 0.7 and 0.3 <= levenshtein(text1, text2) <= 0.7
+
+
+def reference_buckets(messages):
+    """
+    Reference correlation: the pairwise loop of the original data_corellation, scoring every pair with simphile's
+    multiset Jaccard and the full Levenshtein distance.
+
+    Returns:
+        dict: Bucket ID -> list of member IDs, for buckets with at least one match.
+    """
+    buckets = {}
+    assigned = set()
+    for message1 in messages:
+        if message1["id"] in assigned:
+            continue
+        bucket = buckets[message1["id"]] = [message1]
+        assigned.add(message1["id"])
+        for message2 in messages:
+            if message2["id"] in assigned:
+                continue
+            if not similar(message1["message"], message2["message"]):
+                continue
+            if "channel_id" not in message1 and "channel_id" not in message2:
+                date1 = datetime.strptime(message1["date"], "%Y-%m-%d %H:%M")
+                date2 = datetime.strptime(message2["date"], "%Y-%m-%d %H:%M")
+                time_diff = abs((date2 - date1).total_seconds()) / 3600
+                domain1, domain2 = message1["domain_classification"], message2["domain_classification"]
+                if domain1 == "International" and ("Local" in domain2 or domain2 == "Unknown") and time_diff > 0.5:
+                    continue
+                if domain2 == "International" and ("Local" in domain1 or domain1 == "Unknown") and time_diff > 0.5:
+                    continue
+            if message2["message"] not in [member["message"] for member in bucket]:
+                bucket.append(message2)
+                assigned.add(message2["id"])
+    return {bucket_id: [member["id"] for member in bucket] for bucket_id, bucket in buckets.items() if len(bucket) > 1}
+
+
+def members(message_buckets):
+    """
+    Returns:
+        dict: Bucket ID -> list of member IDs, for buckets with at least one match.
+    """
+    return {bucket_id: [msg["id"] for msg in bucket["messages"]]
+            for bucket_id, bucket in message_buckets.items() if bucket["count"] > 0}
+
+
+def matched_pairs(buckets):
+    """
+    Returns:
+        set: (bucket ID, member ID) pairs of the matched members.
+    """
+    return {(bucket_id, member) for bucket_id, ids in buckets.items() for member in ids[1:]}
+
+
+@pytest.fixture(scope="module")
+def messages():
+    return snapshot_messages()
+
+
+@pytest.fixture(scope="module")
+def reference(messages):
+    return reference_buckets(messages)
+
+
+@pytest.fixture
+def correlation(load_lambda):
+    return load_lambda('data_corellation')
+
+
+def test_exhaustive_matches_reference(correlation, messages, reference):
+    assert reference, "the snapshot slice has no similar messages"
+    message_buckets = correlation.generate_message_buckets(copy.deepcopy(messages), mode="exhaustive",
+                                                           max_time_gap_hours=0, workers=1)
+    assert members(message_buckets) == reference
+
+
+def test_lsh_recalls_reference(correlation, messages, reference):
+    message_buckets = correlation.generate_message_buckets(copy.deepcopy(messages), mode="lsh",
+                                                           max_time_gap_hours=0, workers=1)
+    found, expected = matched_pairs(members(message_buckets)), matched_pairs(reference)
+    # LSH only skips candidate pairs, every pair it matches passes the exhaustive rules
+    texts = {message["id"]: message["message"] for message in messages}
+    assert all(similar(texts[bucket_id], texts[member]) for bucket_id, member in found)
+    assert len(found & expected) >= 0.9 * len(expected)
+
+
+def test_incremental_matches_one_shot(correlation, messages):
+    first, second = messages[:SLICE_SIZE // 2], messages[SLICE_SIZE // 2:]
+    one_shot = correlation.generate_message_buckets(copy.deepcopy(messages), mode="exhaustive",
+                                                    max_time_gap_hours=0, workers=1)
+
+    # The first files, then the next ones matched against the seeds of the buckets kept in the state
+    existing = correlation.generate_message_buckets(copy.deepcopy(first), mode="exhaustive",
+                                                    max_time_gap_hours=0, workers=1)
+    by_id = {message["id"]: message for message in first}
+    seeds = [copy.deepcopy(by_id[bucket_id]) for bucket_id in existing]
+    incremental = correlation.generate_message_buckets(seeds + copy.deepcopy(second), mode="exhaustive",
+                                                       max_time_gap_hours=0, workers=1, existing_buckets=existing)
+    assert members(incremental) == members(one_shot)
+    assert {bucket_id: bucket["count"] for bucket_id, bucket in incremental.items()} == \
+        {bucket_id: bucket["count"] for bucket_id, bucket in one_shot.items()}
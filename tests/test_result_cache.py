@@ -0,0 +1,46 @@
+import boto3
+from botocore.exceptions import EndpointConnectionError
+from botocore.stub import Stubber
+
+from result_cache import S3Store, TwoTierCache
+
+
+def stubbed_store():
+    client = boto3.client('s3', region_name='us-east-1', aws_access_key_id='test', aws_secret_access_key='test')
+    store = S3Store('geoshield-cache', 'location-cache/')
+    store.client = client
+    return store, Stubber(client)
+
+
+def test_s3_errors_are_a_miss_and_a_no_op():
+    store, stubber = stubbed_store()
+    # A missing key read without s3:ListBucket, then throttled writes and deletes
+    stubber.add_client_error('get_object', service_error_code='AccessDenied', http_status_code=403)
+    stubber.add_client_error('get_object', service_error_code='NoSuchKey', http_status_code=404)
+    stubber.add_client_error('put_object', service_error_code='SlowDown', http_status_code=503)
+    stubber.add_client_error('delete_object', service_error_code='SlowDown', http_status_code=503)
+    with stubber:
+        assert store.get('key') is None
+        assert store.get('key') is None
+        store.put('key', {"value": "Kyiv", "expires_at": 0})
+        store.delete('key')
+    stubber.assert_no_pending_responses()
+
+
+class UnreachableClient:
+    def get_object(self, **kwargs):
+        raise EndpointConnectionError(endpoint_url='https://s3.amazonaws.com')
+
+    def put_object(self, **kwargs):
+        raise EndpointConnectionError(endpoint_url='https://s3.amazonaws.com')
+
+
+def test_cache_keeps_working_without_its_store():
+    store = S3Store('geoshield-cache', 'location-cache/')
+    store.client = UnreachableClient()
+    cache = TwoTierCache(store=store)
+
+    assert cache.get('key') == (None, False)
+    cache.put('key', 'Kyiv')
+    assert cache.get('key') == ('Kyiv', True)
+    assert cache.stats()["misses"] == 1